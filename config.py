@@ -99,11 +99,15 @@ TABLES = {
             "filename TEXT, filepath TEXT, doc_type TEXT, doc_number TEXT,"
             "doc_date TEXT, sender TEXT, status TEXT, tags TEXT,"
             "description TEXT, is_controlled INTEGER DEFAULT 0, deadline TEXT,"
-            "folder TEXT, last_modified REAL, file_hash TEXT, is_new INTEGER DEFAULT 0"
+            "folder TEXT, last_modified REAL, file_hash TEXT, is_new INTEGER DEFAULT 0,"
+            "size INTEGER, inode INTEGER, ctime REAL"
         ),
         "indices": [
             ("idx_documents_hash", "file_hash"),
             ("idx_documents_is_new", "is_new"),
+            ("idx_documents_folder", "folder"),
+            ("idx_documents_inode", "inode"),
+            ("idx_documents_size", "size"),
         ],
     },
     "document_types": {
@@ -130,6 +134,51 @@ TABLES = {
         ),
         "indices": [
             ("idx_numbers_doc", "document_id"),
+            ("idx_num_value", "number_value"),
+        ],
+    },
+    "scan_dirs": {
+        "columns": (
+            "path TEXT PRIMARY KEY, root TEXT, parent TEXT,"
+            "mtime REAL, entry_count INTEGER, scanned_at REAL"
+        ),
+        "indices": [
+            ("idx_scan_dirs_root", "root"),
+        ],
+    },
+    "scan_journal": {
+        "columns": (
+            "root TEXT PRIMARY KEY, started REAL, full_scan INTEGER,"
+            "since_id INTEGER, done INTEGER DEFAULT 0"
+        ),
+        "indices": [],
+    },
+    "scan_vanished": {
+        "columns": (
+            "doc_id INTEGER PRIMARY KEY, root TEXT"
+        ),
+        "indices": [],
+    },
+    # Групи дублікатів за повним хешем (підтримуються тригерами на documents):
+    # канонічний запис — джерело метаданих для решти учасників групи
+    "duplicate_groups": {
+        "columns": (
+            "file_hash TEXT PRIMARY KEY, canonical_id INTEGER, member_count INTEGER NOT NULL DEFAULT 0"
+        ),
+        "indices": [
+            ("idx_duplicate_groups_count", "member_count"),
+        ],
+    },
+    # Кеш повних хешів за (size, mtime_ns, inode): перейменований, переміщений
+    # або повторно доданий файл не перечитується
+    "file_fingerprints": {
+        "columns": (
+            "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, "
+            "file_hash TEXT NOT NULL, used_at REAL, "
+            "PRIMARY KEY (size, mtime_ns, inode)"
+        ),
+        "indices": [
+            ("idx_fingerprints_used_at", "used_at"),
         ],
     },
 }
\ No newline at end of file
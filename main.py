@@ -1,13 +1,37 @@
-from modules.database import init_db, populate_initial_types
-from modules.scanner import insert_new_files
-from modules.ui import DocumentApp
+import argparse
+import logging
+import multiprocessing
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Реєстр документів")
+    parser.add_argument("--reset-scan-journal", action="store_true",
+                        help="відкинути журнал перерваного сканування і почати спочатку")
+    parser.add_argument("--full-scan", action="store_true",
+                        help="пройти всі каталоги, ігноруючи збережений стан")
+    parser.add_argument("--log-level", default="INFO",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="рівень деталізації виводу в консоль")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    # Модулі програми імпортуються лише тут: процеси пулу хешування (spawn на
+    # Windows) заново імпортують головний модуль і не мають відкривати БД чи UI
+    from modules.database import init_db, clear_scan_journal
+    from modules.ui import DocumentApp
+
+    logging.basicConfig(
+        level=getattr(logging, args.log_level),
+        format="%(asctime)s %(levelname)s [%(name)s] %(message)s"
+    )
     init_db()
-    insert_new_files()
-    populate_initial_types()
-    app = DocumentApp()
+    if args.reset_scan_journal:
+        clear_scan_journal()
+    # Первинне сканування запускає саме вікно у фоновому потоці (див. DocumentApp.start_scan)
+    app = DocumentApp(full_scan=args.full_scan)
     app.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Потрібно для пулу процесів хешування у зібраному .exe (Windows)
+    multiprocessing.freeze_support()
+    main()
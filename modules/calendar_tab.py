@@ -3,9 +3,8 @@
 import tkinter as tk
 from tkinter import ttk
 from tkcalendar import Calendar
-import sqlite3
 from datetime import datetime, timedelta
-from config import DB_PATH
+from .database import db
 from .context_menu import build_context_menu, open_selected
 
 class CalendarTab(tk.Frame):
@@ -60,16 +59,13 @@ class CalendarTab(tk.Frame):
     def _populate_list(self, date_str):
         for iid in self.list.get_children():
             self.list.delete(iid)
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("""
+        rows = db.query("""
             SELECT id, filename, doc_type, deadline
               FROM documents
              WHERE deadline=?
         """, (date_str,))
-        for doc_id, fn, typ, dl in cur.fetchall():
+        for doc_id, fn, typ, dl in rows:
             self.list.insert('', 'end', iid=str(doc_id), values=(fn, typ, dl))
-        conn.close()
 
     def _on_row_double(self, event):
         item = self.list.focus()
@@ -100,15 +96,13 @@ class CalendarTab(tk.Frame):
         self.calendar.calevent_create(today, 'Сьогодні', 'today')
 
     # Підсвітити терміни
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("""
+        rows = db.query("""
         SELECT DISTINCT deadline
           FROM documents
          WHERE is_controlled=1
            AND deadline IS NOT NULL
         """)
-        for (d,) in cur.fetchall():
+        for (d,) in rows:
             try:
                 dt = datetime.fromisoformat(d).date()
             except:
@@ -120,4 +114,3 @@ class CalendarTab(tk.Frame):
             else:
                 tag = 'deadline'
             self.calendar.calevent_create(dt, 'Термін', tag)
-        conn.close()   
@@ -7,7 +7,7 @@ from tkinter import simpledialog, messagebox
 from .utils import rename_file, delete_file
 from .edit_window import EditWindow
 from .links_window import LinksWindow
-from .database import db, get_linked_count
+from .database import db, get_linked_count, get_documents, delete_documents
 
 # === Дії над документом ===
 
@@ -76,14 +76,11 @@ def delete_selected(app):
         return
     if not messagebox.askyesno("Підтвердження", "Видалити файл?"):
         return
-    rows = db.query(
-        "SELECT filepath FROM documents WHERE id=?", (doc_id,)
-    )
-    db.execute(
-        "DELETE FROM documents WHERE id=?", (doc_id,)
-    )
-    if rows:
-        delete_file(rows[0][0])
+    paths = get_documents([doc_id], ('filepath',))
+    # Разом з номерами та зв'язками запису
+    delete_documents([doc_id])
+    for filepath, in paths.values():
+        delete_file(filepath)
     app.load_registry_data()
 
 
@@ -1,3 +1,8 @@
+import json
+import logging
+import os
+import sqlite3
+import time
 from modules.db import Database
 from config import DB_PATH, TABLES, INITIAL_DOCUMENT_TYPES, REVERSE_LINKS
 
@@ -5,102 +10,954 @@ from config import DB_PATH, TABLES, INITIAL_DOCUMENT_TYPES, REVERSE_LINKS
 # Єдине довгоживе підключення та оптимізовані PRAGMA налаштування в Database
 db = Database(DB_PATH)
 
+logger = logging.getLogger(__name__)
+
+# Поля метаданих, які вводить користувач (синхронізуються між дублікатами)
+METADATA_FIELDS = [
+    'doc_type', 'doc_number', 'doc_date', 'sender',
+    'status', 'tags', 'description', 'is_controlled', 'deadline'
+]
+
+# Колонки, додані після першої версії схеми таблиць (міграція ALTER TABLE)
+_COLUMN_MIGRATIONS = {
+    'documents': {
+        'file_hash': 'TEXT',
+        'size': 'INTEGER',
+        'inode': 'INTEGER',
+        'ctime': 'REAL',
+    },
+    'scan_dirs': {
+        'scanned_at': 'REAL',
+    },
+}
+
+
+def _full_hash_sql(col):
+    """SQL-умова «col — повний хеш вмісту» (див. utils.is_full_hash)."""
+    return f"({col} IS NOT NULL AND {col} NOT LIKE 'size:%' AND {col} NOT LIKE 'part:%')"
+
+
+# Тригери, що підтримують duplicate_groups (групи записів з однаковим повним хешем)
+_GROUP_ADD_SQL = """
+    INSERT INTO duplicate_groups (file_hash, canonical_id, member_count)
+    SELECT new.file_hash, new.id, 1 WHERE {full}
+    ON CONFLICT (file_hash) DO UPDATE SET
+        member_count = member_count + 1,
+        canonical_id = MIN(canonical_id, excluded.canonical_id);
+"""
+_GROUP_REMOVE_SQL = """
+    UPDATE duplicate_groups SET
+        member_count = member_count - 1,
+        canonical_id = CASE WHEN canonical_id = old.id THEN (
+            SELECT MIN(id) FROM documents WHERE file_hash = old.file_hash AND id != old.id
+        ) ELSE canonical_id END
+     WHERE file_hash = old.file_hash;
+    DELETE FROM duplicate_groups WHERE file_hash = old.file_hash AND member_count <= 0;
+"""
+_DUPLICATE_GROUP_TRIGGERS = {
+    'trg_documents_hash_insert': (
+        "AFTER INSERT ON documents WHEN new.file_hash IS NOT NULL BEGIN"
+        + _GROUP_ADD_SQL.format(full=_full_hash_sql('new.file_hash'))
+        + "END"
+    ),
+    'trg_documents_hash_update': (
+        "AFTER UPDATE OF file_hash ON documents WHEN old.file_hash IS NOT new.file_hash BEGIN"
+        + _GROUP_REMOVE_SQL
+        + _GROUP_ADD_SQL.format(full=_full_hash_sql('new.file_hash'))
+        + "END"
+    ),
+    'trg_documents_hash_delete': (
+        "AFTER DELETE ON documents WHEN old.file_hash IS NOT NULL BEGIN" + _GROUP_REMOVE_SQL + "END"
+    ),
+}
+
+# Поля пошуку (дерево, вікно зв'язків; з індексом і без): колонки documents або
+# SQL-вирази над записом {a} — пошук іде по тексту, який показує дерево
+SEARCH_FIELDS = (
+    'filename', 'folder', 'sender', 'description', 'doc_number',
+    'status', 'doc_type', 'tags', 'doc_date', 'deadline',
+    # «Контроль» і «Змінено» (як format_modified у tree_setup)
+    "CASE WHEN {a}.is_controlled THEN '✅' END",
+    "strftime('%d-%m-%Y %H:%M', {a}.last_modified, 'unixepoch', 'localtime')",
+)
+# Поля з окремою колонкою в documents_fts; решта SEARCH_FIELDS — у колонці attrs
+_FTS_COLUMNS = SEARCH_FIELDS[:5]
+# Колонки documents, від яких залежить текст пошуку
+_SEARCH_SOURCE_COLUMNS = (*SEARCH_FIELDS[:10], 'is_controlled', 'last_modified')
+
+
+def _search_text_sql(fields, alias):
+    """Значення полів fields (див. SEARCH_FIELDS) запису alias через пробіл."""
+    return " || ' ' || ".join(
+        f"COALESCE({f.format(a=alias) if '{a}' in f else f'{alias}.{f}'}, '')" for f in fields
+    )
+
+
+# Повнотекстовий індекс пошуку (FTS5, триграми: пошук підрядка, зокрема кирилицею);
+# rowid = documents.id, numbers — додаткові номери, attrs — решта полів SEARCH_FIELDS
+_SEARCH_INDEX_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5("
+    f"{', '.join(_FTS_COLUMNS)}, numbers, attrs, tokenize='trigram')"
+)
+_SEARCH_INDEX_INSERT_SQL = f"""
+    INSERT INTO documents_fts (rowid, {', '.join(_FTS_COLUMNS)}, numbers, attrs)
+    SELECT d.id, {', '.join('d.' + c for c in _FTS_COLUMNS)},
+           (SELECT group_concat(n.number_value, ' ') FROM document_numbers n WHERE n.document_id = d.id),
+           {_search_text_sql(SEARCH_FIELDS[5:], 'd')}
+      FROM documents d WHERE {{where}};
+"""
+_SEARCH_INDEX_TRIGGERS = {
+    # Новий запис (AUTOINCREMENT) ще не має додаткових номерів
+    'trg_documents_fts_insert': (
+        "AFTER INSERT ON documents BEGIN "
+        f"INSERT INTO documents_fts (rowid, {', '.join(_FTS_COLUMNS)}, attrs) "
+        f"VALUES (new.id, {', '.join('new.' + c for c in _FTS_COLUMNS)}, "
+        f"{_search_text_sql(SEARCH_FIELDS[5:], 'new')}); "
+        "END"
+    ),
+    'trg_documents_fts_update': (
+        f"AFTER UPDATE OF {', '.join(_SEARCH_SOURCE_COLUMNS)} ON documents BEGIN "
+        "DELETE FROM documents_fts WHERE rowid = old.id;"
+        + _SEARCH_INDEX_INSERT_SQL.format(where="d.id = new.id")
+        + "END"
+    ),
+    'trg_documents_fts_delete': (
+        "AFTER DELETE ON documents BEGIN DELETE FROM documents_fts WHERE rowid = old.id; END"
+    ),
+    'trg_numbers_fts_insert': (
+        "AFTER INSERT ON document_numbers BEGIN "
+        "DELETE FROM documents_fts WHERE rowid = new.document_id;"
+        + _SEARCH_INDEX_INSERT_SQL.format(where="d.id = new.document_id")
+        + "END"
+    ),
+    'trg_numbers_fts_update': (
+        "AFTER UPDATE ON document_numbers BEGIN "
+        "DELETE FROM documents_fts WHERE rowid IN (old.document_id, new.document_id);"
+        + _SEARCH_INDEX_INSERT_SQL.format(where="d.id IN (old.document_id, new.document_id)")
+        + "END"
+    ),
+    'trg_numbers_fts_delete': (
+        "AFTER DELETE ON document_numbers BEGIN "
+        "DELETE FROM documents_fts WHERE rowid = old.document_id;"
+        + _SEARCH_INDEX_INSERT_SQL.format(where="d.id = old.document_id")
+        + "END"
+    ),
+}
+
+# Коротші терміни не мають жодної триграми — для них пошук без індексу
+FTS_MIN_TERM = 3
+# Токенізатор trigram з'явився в SQLite 3.34
+FTS_MIN_SQLITE = (3, 34, 0)
+# Чи готовий documents_fts (визначає init_db); інакше пошук без індексу
+_search_index_ready = False
+
+# Межі кешу file_fingerprints: кількість записів і вік (с) від останнього використання
+FINGERPRINT_CACHE_SIZE = 500000
+FINGERPRINT_CACHE_AGE = 365 * 24 * 3600
+
+# Файл вважається незміненим, якщо збігаються (size, mtime, inode);
+# невідомі (NULL) size/inode старих записів не вважаються зміною
+_UNCHANGED_SQL = (
+    "last_modified IS excluded.last_modified "
+    "AND (size IS NULL OR size = excluded.size) "
+    "AND (inode IS NULL OR inode = excluded.inode)"
+)
+
+# Вставка з оновленням stat-полів лише для змінених файлів;
+# хеш зміненого файлу скидається для повторного обчислення
+_UPSERT_DOCUMENT_SQL = (
+    "INSERT INTO documents (filename, filepath, folder, last_modified, file_hash, size, inode, ctime, is_new) "
+    "VALUES (?,?,?,?,?,?,?,?,1) "
+    "ON CONFLICT(filepath) DO UPDATE SET "
+    f"file_hash=CASE WHEN {_UNCHANGED_SQL} THEN file_hash ELSE NULL END, "
+    "last_modified=excluded.last_modified, size=excluded.size, "
+    "inode=excluded.inode, ctime=excluded.ctime "
+    "WHERE last_modified IS NOT excluded.last_modified OR size IS NOT excluded.size "
+    "OR inode IS NOT excluded.inode OR ctime IS NOT excluded.ctime"
+)
+
+# Оновлення stat-полів фоновою перевіркою (ті самі правила, що й у _UPSERT_DOCUMENT_SQL)
+_REFRESH_STAT_SQL = (
+    "UPDATE documents SET "
+    "file_hash=CASE WHEN last_modified IS :mtime AND (size IS NULL OR size = :size) "
+    "AND (inode IS NULL OR inode = :inode) THEN file_hash ELSE NULL END, "
+    "last_modified=:mtime, size=:size, inode=:inode, ctime=:ctime, is_missing=0 "
+    "WHERE id=:id"
+)
+
 
 def init_db():
     """
-    Створює всі необхідні таблиці та індекси за описом у TABLES,
-    проводить міграцію для file_hash та налаштовує PRAGMA для продуктивності.
+    Доводить схему БД до поточної версії (PRAGMA user_version).
+    Актуальна БД лише читає user_version: жодних DDL і блокування запису при старті.
+    Кроки міграцій виконуються по черзі в одній транзакції (див. _MIGRATIONS).
     """
-    # Виконуємо всі DDL та міграції в рамках транзакції
-    with db.transaction():
-        cur = db._conn.cursor()
-        # Налаштування WAL та синхронізації (PRAGMA задаються при ініціалізації db)
-        cur.execute("PRAGMA journal_mode=WAL;")
-        cur.execute("PRAGMA synchronous=NORMAL;")
+    if _schema_version() < SCHEMA_VERSION:
+        with db.transaction():
+            cur = db._conn.cursor()
+            if not db._conn.in_transaction:
+                cur.execute("BEGIN IMMEDIATE")
+            # Повторна перевірка під блокуванням запису (інший процес міг уже мігрувати)
+            version = cur.execute("PRAGMA user_version").fetchone()[0]
+            for step, migrate in enumerate(_MIGRATIONS[version:], start=version + 1):
+                migrate(cur)
+                cur.execute(f"PRAGMA user_version = {step}")
+    _check_search_index()
+
+
+def _schema_version():
+    return db.query("PRAGMA user_version")[0][0]
+
+
+def _create_tables(cur):
+    """Таблиці за описом у TABLES (для наявних БД — лише відсутні)."""
+    for name, info in TABLES.items():
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {name} ({info['columns']})")
+
+
+def _add_column(cur, table, col, col_type):
+    """Додає колонку, якщо її ще немає (БД, створені до появи колонки)."""
+    cols = [row[1] for row in cur.execute(f"PRAGMA table_info({table})").fetchall()]
+    if col not in cols:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}")
+
+
+def _add_late_columns(cur):
+    """Колонки, додані після першої версії схеми таблиць."""
+    for table, columns in _COLUMN_MIGRATIONS.items():
+        for col, col_type in columns.items():
+            _add_column(cur, table, col, col_type)
+
+
+def _create_indices(cur):
+    """Індекси за описом у TABLES."""
+    for name, info in TABLES.items():
+        for idx_name, col in info.get('indices', []):
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {idx_name} ON {name}({col})")
+
 
-        # Створення/міграція таблиць та індексів
-        for name, info in TABLES.items():
-            # Створити таблицю, якщо відсутня
-            cur.execute(f"CREATE TABLE IF NOT EXISTS {name} ({info['columns']})")
+def _create_duplicate_groups(cur):
+    """Тригери duplicate_groups і групи з наявних хешів."""
+    for trg_name, body in _DUPLICATE_GROUP_TRIGGERS.items():
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {trg_name} {body}")
+    rebuild_duplicate_groups(cur)
 
-            # Для documents забезпечити колонку file_hash
-            if name == 'documents':
-                cols = [row[1] for row in cur.execute("PRAGMA table_info(documents)").fetchall()]
-                if 'file_hash' not in cols:
-                    cur.execute("ALTER TABLE documents ADD COLUMN file_hash TEXT")
 
-            # Створити індекси
-            for idx_name, col in info.get('indices', []):
-                cur.execute(f"CREATE INDEX IF NOT EXISTS {idx_name} ON {name}({col})")
+def fts_available():
+    """FTS5 з токенізатором trigram: SQLite від FTS_MIN_SQLITE, зібраний з ENABLE_FTS5."""
+    if sqlite3.sqlite_version_info < FTS_MIN_SQLITE:
+        return False
+    return bool(db.query("SELECT sqlite_compileoption_used('ENABLE_FTS5')")[0][0])
 
 
-def populate_initial_types():
+def _check_search_index():
     """
-    Вставляє початкові типи документів та категорії з INITIAL_DOCUMENT_TYPES.
+    Узгоджує documents_fts з можливостями поточної SQLite. Без FTS5 тригери
+    синхронізації видаляються (інакше запис у documents падав би) і пошук
+    працює через instr(ulower(...)); коли FTS5 знову доступний — індекс
+    створюється і заповнюється заново.
     """
-    db.executemany(
+    global _search_index_ready
+    names = {row[0] for row in db.query(
+        "SELECT name FROM sqlite_master WHERE name IN ('documents_fts', 'trg_documents_fts_insert')"
+    )}
+    available = fts_available()
+    if available and len(names) == 2:
+        _search_index_ready = True
+        return
+    if available:
+        with db.transaction():
+            _create_search_index(db._conn.cursor())
+    else:
+        logger.warning("SQLite %s without FTS5 trigram support: search runs without index",
+                       sqlite3.sqlite_version)
+        if names:
+            with db.transaction():
+                for trg_name in _SEARCH_INDEX_TRIGGERS:
+                    db.execute(f"DROP TRIGGER IF EXISTS {trg_name}")
+    _search_index_ready = available
+
+
+def search_index_ready():
+    """Чи можна шукати через documents_fts MATCH (див. _check_search_index)."""
+    return _search_index_ready
+
+
+def search_match_sql(alias='d'):
+    """
+    Умова «запис alias містить ?» без індексу documents_fts (SQLite без FTS5 або
+    term коротший за FTS_MIN_TERM) — по тих самих полях SEARCH_FIELDS і додаткових
+    номерах; параметри: (term, term), term — з normalize_term.
+    """
+    text = _search_text_sql(SEARCH_FIELDS, alias)
+    return (
+        f"(instr(ulower({text}), ?) > 0 OR EXISTS ("
+        f"SELECT 1 FROM document_numbers n WHERE n.document_id = {alias}.id "
+        "AND instr(ulower(n.number_value), ?) > 0))"
+    )
+
+
+def _create_search_index(cur):
+    """
+    Таблиця documents_fts, тригери синхронізації та заповнення з наявних записів.
+    Без FTS5 крок нічого не робить (див. _check_search_index).
+    """
+    if not fts_available():
+        return
+    cur.execute(_SEARCH_INDEX_SQL)
+    for trg_name, body in _SEARCH_INDEX_TRIGGERS.items():
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {trg_name} {body}")
+    cur.execute("DELETE FROM documents_fts")
+    cur.execute(_SEARCH_INDEX_INSERT_SQL.format(where="1"))
+
+
+def _rebuild_search_index(cur):
+    """Тригери та вміст documents_fts заново — після зміни SEARCH_FIELDS."""
+    for trg_name in _SEARCH_INDEX_TRIGGERS:
+        cur.execute(f"DROP TRIGGER IF EXISTS {trg_name}")
+    _create_search_index(cur)
+
+
+def _index(name, table, columns):
+    """Крок міграції: індекс name на table(columns)."""
+    def step(cur):
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+    step.__name__ = f"_index_{name}"
+    return step
+
+
+def _column(table, col, col_type):
+    """Крок міграції: нова колонка table.col."""
+    def step(cur):
+        _add_column(cur, table, col, col_type)
+    step.__name__ = f"_column_{table}_{col}"
+    step.column = (table, col)
+    return step
+
+
+def _drop_journal_cursor(cur):
+    """scan_journal без колонки cursor (продовження визначає scan_dirs.scanned_at)."""
+    cols = [row[1] for row in cur.execute("PRAGMA table_info(scan_journal)").fetchall()]
+    if 'cursor' not in cols:
+        return
+    cur.execute(
+        "CREATE TABLE scan_journal_new (root TEXT PRIMARY KEY, started REAL, "
+        "full_scan INTEGER, since_id INTEGER, done INTEGER DEFAULT 0)"
+    )
+    cur.execute(
+        "INSERT INTO scan_journal_new (root, started, full_scan, since_id, done) "
+        "SELECT root, started, full_scan, since_id, done FROM scan_journal"
+    )
+    cur.execute("DROP TABLE scan_journal")
+    cur.execute("ALTER TABLE scan_journal_new RENAME TO scan_journal")
+
+
+def _populate_initial_types(cur):
+    """Початкові типи документів та категорії з INITIAL_DOCUMENT_TYPES."""
+    cur.executemany(
         "INSERT OR IGNORE INTO document_types (type_name, category) VALUES (?, ?)",
         INITIAL_DOCUMENT_TYPES
     )
 
 
+def _unique_filepaths(cur):
+    """Унікальний індекс по filepath (з об'єднанням наявних дублікатів)."""
+    exists = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_documents_filepath'"
+    ).fetchone()
+    if not exists:
+        _merge_duplicate_filepaths(cur)
+        cur.execute("CREATE UNIQUE INDEX idx_documents_filepath ON documents(filepath)")
+
+
+def _merge_duplicate_filepaths(cur):
+    """
+    Об'єднує записи documents з однаковим filepath в один (з найменшим id):
+    порожні поля метаданих заповнюються з дублікатів, номери та зв'язки
+    переносяться на збережений запис, дублікати видаляються.
+    """
+    cur.execute("DROP TABLE IF EXISTS temp.dup_map")
+    cur.execute("""
+        CREATE TEMP TABLE dup_map AS
+        SELECT d.id AS dup_id, k.keep_id
+          FROM documents d
+          JOIN (SELECT filepath, MIN(id) AS keep_id
+                  FROM documents
+                 WHERE filepath IS NOT NULL
+                 GROUP BY filepath HAVING COUNT(*) > 1) k
+            ON d.filepath = k.filepath
+         WHERE d.id != k.keep_id
+    """)
+    if not cur.execute("SELECT 1 FROM dup_map LIMIT 1").fetchone():
+        cur.execute("DROP TABLE dup_map")
+        return
+
+    for f in METADATA_FIELDS + ['file_hash']:
+        cur.execute(f"""
+            UPDATE documents SET {f} = (
+                SELECT d.{f} FROM documents d JOIN dup_map m ON m.dup_id = d.id
+                 WHERE m.keep_id = documents.id AND COALESCE(d.{f}, '') NOT IN ('', 0)
+                 ORDER BY d.id LIMIT 1)
+             WHERE id IN (SELECT keep_id FROM dup_map)
+               AND COALESCE({f}, '') IN ('', 0)
+               AND EXISTS (
+                SELECT 1 FROM documents d JOIN dup_map m ON m.dup_id = d.id
+                 WHERE m.keep_id = documents.id AND COALESCE(d.{f}, '') NOT IN ('', 0))
+        """)
+
+    remap = "(SELECT keep_id FROM dup_map WHERE dup_id = {col})"
+    cur.execute(f"""
+        UPDATE document_numbers SET document_id = {remap.format(col='document_id')}
+         WHERE document_id IN (SELECT dup_id FROM dup_map)
+    """)
+    for col in ('from_doc_id', 'to_doc_id'):
+        cur.execute(f"""
+            UPDATE document_links SET {col} = {remap.format(col=col)}
+             WHERE {col} IN (SELECT dup_id FROM dup_map)
+        """)
+    # Зв'язки, що після об'єднання стали зв'язками документа з самим собою
+    cur.execute("DELETE FROM document_links WHERE from_doc_id = to_doc_id")
+    cur.execute("DELETE FROM documents WHERE id IN (SELECT dup_id FROM dup_map)")
+    cur.execute("DROP TABLE dup_map")
+
+
+# Кроки міграцій схеми; номер кроку (з 1) — значення PRAGMA user_version після нього.
+# Кожен крок ідемпотентний, бо БД версії 0 (до появи міграцій) вже можуть мати
+# частину схеми. TABLES описує схему на момент першої версії; нові таблиці,
+# колонки чи індекси додаються окремим кроком у кінці списку.
+_MIGRATIONS = [
+    _create_tables,
+    _add_late_columns,
+    _create_indices,
+    _create_duplicate_groups,
+    _unique_filepaths,
+    # зв'язки документа в обидва боки (get_linked_count, get_linked_docs, LinksWindow)
+    _index("idx_links_from", "document_links", "from_doc_id, to_doc_id, link_type"),
+    _index("idx_links_to", "document_links", "to_doc_id, from_doc_id, link_type"),
+    # календар: документи на дату і підсвітка контрольних термінів
+    _index("idx_documents_deadline", "documents", "deadline"),
+    _index("idx_documents_controlled_deadline", "documents", "is_controlled, deadline"),
+    # фільтр за датою документа
+    _index("idx_documents_doc_date", "documents", "doc_date"),
+    _index("idx_scan_vanished_root", "scan_vanished", "root"),
+    # файл зник з диска (оновлює фонова перевірка stat)
+    _column("documents", "is_missing", "INTEGER DEFAULT 0"),
+    # пошук у дереві та вікні зв'язків
+    _create_search_index,
+    _drop_journal_cursor,
+    # «Контроль» і «Змінено» в тексті пошуку
+    _rebuild_search_index,
+    _populate_initial_types,
+]
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+# Усі колонки documents (для перевірки імен у get_documents/update_documents):
+# схема першої версії, пізні колонки та колонки кроків міграцій
+DOCUMENT_COLUMNS = frozenset(
+    [col.split()[0] for col in TABLES['documents']['columns'].split(',') if col.strip()]
+    + list(_COLUMN_MIGRATIONS['documents'])
+    + [step.column[1] for step in _MIGRATIONS
+       if getattr(step, 'column', (None,))[0] == 'documents']
+)
+
+
 def clear_documents():
     db.execute("DELETE FROM document_numbers")
     db.execute("DELETE FROM documents")
+    clear_scan_state()
 
 
-def get_existing_filepaths():
-    rows = db.query("SELECT filepath FROM documents")
-    return [r[0] for r in rows]
-
-
-def insert_document(filename, filepath, folder, last_modified, file_hash=None):
+def insert_document(filename, filepath, folder, last_modified, file_hash=None,
+                    size=None, inode=None, ctime=None):
     return db.execute(
-        "INSERT INTO documents (filename, filepath, folder, last_modified, file_hash, is_new) VALUES (?,?,?,?,?,1)",
-        (filename, filepath, folder, last_modified, file_hash)
+        _UPSERT_DOCUMENT_SQL,
+        (filename, filepath, folder, last_modified, file_hash, size, inode, ctime)
     )
 
 
 def insert_documents_batch(records):
     """
     Батчеві вставки для швидшого сканування.
-    records: list of tuples (filename, filepath, folder, last_modified, file_hash)
+    Наявні шляхи не дублюються: для них лише оновлюються stat-поля,
+    якщо вони змінились (перевірка нових файлів виконується в БД).
+    records: list of tuples
+        (filename, filepath, folder, last_modified, file_hash, size, inode, ctime)
     """
-    return db.executemany(
-        "INSERT INTO documents (filename, filepath, folder, last_modified, file_hash, is_new) VALUES (?,?,?,?,?,1)",
-        records
+    return db.executemany(_UPSERT_DOCUMENT_SQL, records)
+
+
+def get_max_document_id():
+    row = db.query("SELECT MAX(id) FROM documents")
+    return row[0][0] or 0
+
+
+def get_documents_since(doc_id):
+    """
+    Записи, додані після doc_id (нові файли поточного сканування):
+    list of tuples (id, filename, filepath, folder, last_modified, size, inode)
+    """
+    return db.query(
+        "SELECT id, filename, filepath, folder, last_modified, size, inode FROM documents WHERE id>?",
+        (doc_id,)
     )
 
 
-def propagate_metadata_for_hash(file_hash, new_id):
+def get_file_stats(after_id, limit):
     """
-    Синхронізує поля метаданих між дублікатами файлів за хешем.
+    Наступні limit записів після after_id (у порядку id) для фонової перевірки stat:
+    list of tuples (id, filepath, last_modified, size, inode, is_missing)
     """
-    fields = [
-        'doc_type','doc_number','doc_date','sender',
-        'status','tags','description','is_controlled','deadline'
-    ]
-    new_vals = db.query(
-        f"SELECT {','.join(fields)} FROM documents WHERE id=?", (new_id,)
-    )[0]
-    if any(new_vals):
-        sets = ','.join(f"{f}=?" for f in fields)
+    return db.query(
+        "SELECT id, filepath, last_modified, size, inode, is_missing FROM documents "
+        "WHERE id>? ORDER BY id LIMIT ?",
+        (after_id, limit)
+    )
+
+
+def save_file_stats(changed, missing):
+    """
+    Результат фонової перевірки stat однією транзакцією.
+    changed: list of dicts {id, mtime, size, inode, ctime} — файли на диску
+             зі зміненими stat-полями (хеш зміненого вмісту скидається);
+    missing: id записів, файлів яких немає на диску.
+    """
+    with db.transaction():
+        db.executemany(_REFRESH_STAT_SQL, changed)
+        db.executemany("UPDATE documents SET is_missing=1 WHERE id=?", [(i,) for i in missing])
+
+
+def get_folder_documents(folder):
+    """
+    Повертає (id, filepath) записів з відносною папкою folder.
+    """
+    return db.query("SELECT id, filepath FROM documents WHERE folder=?", (folder,))
+
+
+def _json_list(values):
+    # Список значень одним параметром: IN (SELECT value FROM json_each(?))
+    # не впирається в ліміт кількості параметрів і планується через індекс
+    return json.dumps(list(values), ensure_ascii=False)
+
+
+def _check_columns(columns):
+    unknown = set(columns) - DOCUMENT_COLUMNS
+    if unknown:
+        raise ValueError(f"Unknown document columns: {sorted(unknown)}")
+
+
+def get_documents(ids, columns=('filename', 'filepath')):
+    """
+    Поля columns записів ids одним запитом.
+    :return: dict {id: tuple(columns)}; відсутні записи пропускаються
+    """
+    _check_columns(columns)
+    if not ids:
+        return {}
+    rows = db.query(
+        f"SELECT id, {', '.join(columns)} FROM documents "
+        "WHERE id IN (SELECT value FROM json_each(?))",
+        (_json_list(ids),)
+    )
+    return {row[0]: row[1:] for row in rows}
+
+
+def update_documents(ids, fields):
+    """
+    Однакові значення fields ({колонка: значення}) для всіх записів ids одним UPDATE.
+    """
+    _check_columns(fields)
+    if not ids or not fields:
+        return
+    assignments = ', '.join(f"{col}=?" for col in fields)
+    db.execute(
+        f"UPDATE documents SET {assignments} WHERE id IN (SELECT value FROM json_each(?))",
+        (*fields.values(), _json_list(ids))
+    )
+
+
+def delete_documents(ids):
+    """
+    Видаляє записи ids разом з їх номерами та зв'язками однією транзакцією.
+    """
+    if not ids:
+        return
+    ids_json = _json_list(ids)
+    with db.transaction():
+        db.execute("DELETE FROM document_numbers WHERE document_id IN (SELECT value FROM json_each(?))",
+                   (ids_json,))
         db.execute(
-            f"UPDATE documents SET {sets} WHERE file_hash=? AND id!=?",
-            (*new_vals, file_hash, new_id)
+            "DELETE FROM document_links WHERE from_doc_id IN (SELECT value FROM json_each(?1)) "
+            "OR to_doc_id IN (SELECT value FROM json_each(?1))",
+            (ids_json,)
         )
+        db.execute("DELETE FROM documents WHERE id IN (SELECT value FROM json_each(?))", (ids_json,))
+
+
+def get_documents_by_sizes(sizes):
+    """
+    Записи з розмірами sizes одним запитом:
+    dict {size: list of tuples (id, filepath, size, last_modified, inode, file_hash)}
+    """
+    groups = {}
+    if not sizes:
+        return groups
+    rows = db.query(
+        "SELECT id, filepath, size, last_modified, inode, file_hash FROM documents "
+        "WHERE size IN (SELECT value FROM json_each(?)) ORDER BY size, id",
+        (_json_list(sizes),)
+    )
+    for row in rows:
+        groups.setdefault(row[2], []).append(row)
+    return groups
+
+
+def get_document_ids_by_paths(paths):
+    if not paths:
+        return []
+    rows = db.query(
+        "SELECT id FROM documents WHERE filepath IN (SELECT value FROM json_each(?))",
+        (_json_list(paths),)
+    )
+    return [r[0] for r in rows]
+
+
+def mark_vanished(doc_ids, root):
+    """
+    Позначає записи, файли яких зникли з диска під час сканування root.
+    Позначки зберігаються в БД до фази узгодження (reconcile).
+    """
+    return db.executemany(
+        "INSERT OR REPLACE INTO scan_vanished (doc_id, root) VALUES (?, ?)",
+        [(doc_id, str(root)) for doc_id in doc_ids]
+    )
+
+
+def get_root_documents(root):
+    """
+    (id, filepath) усіх записів під коренем root
+    (діапазон по filepath замість LIKE — через idx_documents_filepath).
+    """
+    prefix = os.path.join(str(root), '')
+    return db.query(
+        "SELECT id, filepath FROM documents WHERE filepath>=? AND filepath<?",
+        (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    )
+
+
+def get_vanished(root):
+    """
+    Зниклі записи кореня root:
+    list of tuples (id, filename, filepath, last_modified, size, inode, file_hash)
+    """
+    return db.query(
+        """
+        SELECT d.id, d.filename, d.filepath, d.last_modified, d.size, d.inode, d.file_hash
+          FROM scan_vanished v JOIN documents d ON d.id = v.doc_id
+         WHERE v.root=?
+        """, (str(root),)
+    )
+
+
+def apply_reconciliation(root, moves, deleted_ids):
+    """
+    Застосовує результат узгодження однією транзакцією.
+    moves: list of tuples (old_id, new_id) — старий запис переймає шлях нового,
+           а новий (щойно вставлений, без метаданих) видаляється;
+    deleted_ids: записи, файли яких справді видалено.
+    """
+    with db.transaction():
+        cur = db._conn.cursor()
+        for old_id, new_id in moves:
+            row = cur.execute(
+                "SELECT filename, filepath, folder, last_modified, size, inode, ctime "
+                "FROM documents WHERE id=?",
+                (new_id,)
+            ).fetchone()
+            if row is None:
+                continue
+            cur.execute("DELETE FROM documents WHERE id=?", (new_id,))
+            cur.execute(
+                "UPDATE documents SET filename=?, filepath=?, folder=?, last_modified=?, "
+                "size=?, inode=?, ctime=? WHERE id=?",
+                (*row, old_id)
+            )
+        params = [(doc_id,) for doc_id in deleted_ids]
+        cur.executemany("DELETE FROM document_numbers WHERE document_id=?", params)
+        cur.executemany("DELETE FROM document_links WHERE from_doc_id=? OR to_doc_id=?",
+                        [(doc_id, doc_id) for doc_id in deleted_ids])
+        cur.executemany("DELETE FROM documents WHERE id=?", params)
+        cur.execute("DELETE FROM scan_vanished WHERE root=?", (str(root),))
+
+
+def get_scan_state(root):
+    """
+    Повертає збережений стан каталогів кореня root:
+    {path: (parent, mtime, entry_count, scanned_at)}.
+    """
+    rows = db.query(
+        "SELECT path, parent, mtime, entry_count, scanned_at FROM scan_dirs WHERE root=?",
+        (str(root),)
+    )
+    return {path: tuple(rest) for path, *rest in rows}
+
+
+def save_scan_dirs(records):
+    """
+    Зберігає стан просканованих каталогів.
+    records: list of tuples (path, root, parent, mtime, entry_count, scanned_at)
+    """
+    return db.executemany(
+        "INSERT OR REPLACE INTO scan_dirs (path, root, parent, mtime, entry_count, scanned_at) "
+        "VALUES (?,?,?,?,?,?)",
+        records
+    )
+
+
+def delete_scan_dirs(paths):
+    return db.executemany(
+        "DELETE FROM scan_dirs WHERE path=?", [(p,) for p in paths]
+    )
+
+
+def clear_scan_state(root=None):
+    """
+    Скидає збережений стан сканування (для кореня root або повністю),
+    щоб наступне сканування пройшло всі каталоги.
+    """
+    if root is None:
+        db.execute("DELETE FROM scan_dirs")
+        db.execute("DELETE FROM scan_vanished")
+    else:
+        db.execute("DELETE FROM scan_dirs WHERE root=?", (str(root),))
+        db.execute("DELETE FROM scan_vanished WHERE root=?", (str(root),))
+    clear_scan_journal(root)
+
+
+def get_scan_journal(root):
+    """
+    Журнал незавершеного сканування root або None:
+    (started, full_scan, since_id, done), де done — кількість файлів
+    у каталогах, стан яких уже збережено в scan_dirs
+    """
+    row = db.query(
+        "SELECT started, full_scan, since_id, done FROM scan_journal WHERE root=?",
+        (str(root),)
+    )
+    return row[0] if row else None
+
+
+def start_scan_journal(root, started, full_scan, since_id):
+    db.execute(
+        "INSERT OR REPLACE INTO scan_journal (root, started, full_scan, since_id, done) "
+        "VALUES (?,?,?,?,0)",
+        (str(root), started, int(full_scan), since_id)
+    )
+
+
+def update_scan_journal(root, done):
+    db.execute(
+        "UPDATE scan_journal SET done=? WHERE root=?", (done, str(root))
+    )
+
+
+def clear_scan_journal(root=None):
+    """
+    Видаляє журнал сканування: наступне сканування почнеться спочатку.
+    """
+    if root is None:
+        db.execute("DELETE FROM scan_journal")
     else:
-        rows = db.query(
-            f"SELECT id,{','.join(fields)} FROM documents WHERE file_hash=? AND id!=?", (file_hash, new_id)
+        db.execute("DELETE FROM scan_journal WHERE root=?", (str(root),))
+
+
+def _has_metadata_sql(alias):
+    """SQL-умова «запис має хоч одне заповнене поле метаданих» (аналог any(values))."""
+    return '(' + ' OR '.join(
+        f"COALESCE({alias}.{f}, '') NOT IN ('', 0)" for f in METADATA_FIELDS
+    ) + ')'
+
+
+def save_file_hashes(updates, sizes=()):
+    """
+    Записує хеші однією транзакцією, синхронізує метадані дублікатів для всього батчу
+    і запам'ятовує повні хеші в кеші file_fingerprints.
+
+    :param updates: list of tuples (id, file_hash)
+    :param sizes: list of tuples (id, size) — розміри старих записів без size,
+                  що записуються в тій самій транзакції
+    :return: кількість оновлених записів
+    """
+    if not updates and not sizes:
+        return 0
+    with db.transaction():
+        cur = db._conn.cursor()
+        if sizes:
+            cur.executemany("UPDATE documents SET size=? WHERE id=?",
+                            [(size, doc_id) for doc_id, size in sizes])
+        if not updates:
+            return 0
+        cur.executemany(
+            "UPDATE documents SET file_hash=? WHERE id=?",
+            [(fh, doc_id) for doc_id, fh in updates]
         )
-        for rid, *old_vals in rows:
-            if any(old_vals):
-                sets = ','.join(f"{f}=?" for f in fields)
-                db.execute(
-                    f"UPDATE documents SET {sets} WHERE id=?",
-                    (*old_vals, rid)
-                )
-                break
+        count = cur.rowcount
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS hash_batch (id INTEGER PRIMARY KEY)")
+        cur.execute("DELETE FROM hash_batch")
+        cur.executemany("INSERT OR IGNORE INTO hash_batch(id) VALUES (?)", [(i,) for i, _ in updates])
+        _propagate_metadata_batch(cur)
+        _remember_fingerprints(cur)
+        cur.execute("DELETE FROM hash_batch")
+    return count
+
+
+def _propagate_metadata_batch(cur):
+    """
+    Множинна синхронізація метаданих між дублікатами для записів hash_batch через duplicate_groups.
+    Канонічним записом групи стає останній запис батчу з метаданими; якщо ж канонічний
+    запис метаданих не має — перший учасник групи, що їх має. Далі одним UPDATE ... FROM
+    метадані канонічних записів копіюються в записи батчу, а з канонічних записів
+    батчу — в усі їхні дублікати.
+    """
+    # CROSS JOIN фіксує порядок: від записів батчу до documents за id, а не прохід
+    # idx_documents_hash заради GROUP BY
+    batch_hashes = "SELECT x.file_hash FROM hash_batch b CROSS JOIN documents x ON x.id = b.id"
+    cur.execute(f"""
+        UPDATE duplicate_groups SET canonical_id = src.id
+        FROM (
+            SELECT x.file_hash, MAX(x.id) AS id FROM hash_batch b CROSS JOIN documents x ON x.id = b.id
+            WHERE {_has_metadata_sql('x')}
+            GROUP BY x.file_hash
+        ) AS src
+        WHERE duplicate_groups.file_hash = src.file_hash AND duplicate_groups.member_count > 1
+    """)
+    cur.execute(f"""
+        UPDATE duplicate_groups SET canonical_id = donor.id
+        FROM (
+            SELECT d.file_hash, MIN(d.id) AS id FROM documents d
+            WHERE d.file_hash IN ({batch_hashes}) AND {_has_metadata_sql('d')}
+            GROUP BY d.file_hash
+        ) AS donor
+        WHERE duplicate_groups.file_hash = donor.file_hash AND duplicate_groups.member_count > 1
+          AND NOT EXISTS (
+            SELECT 1 FROM documents c
+            WHERE c.id = duplicate_groups.canonical_id AND {_has_metadata_sql('c')})
+    """)
+    sets = ','.join(f"{f}=src.{f}" for f in METADATA_FIELDS)
+    cur.execute(f"""
+        UPDATE documents SET {sets}
+        FROM duplicate_groups g JOIN documents AS src ON src.id = g.canonical_id
+        WHERE documents.file_hash = g.file_hash AND documents.id != src.id
+          AND g.member_count > 1 AND g.file_hash IN ({batch_hashes})
+          AND (documents.id IN (SELECT id FROM hash_batch) OR src.id IN (SELECT id FROM hash_batch))
+          AND {_has_metadata_sql('src')}
+    """)
+
+
+def rebuild_duplicate_groups(cur=None):
+    """Перебудовує duplicate_groups з documents (для наявних БД і після ручних змін)."""
+    sql = [
+        "DELETE FROM duplicate_groups",
+        # канонічний — перший запис з метаданими, інакше перший запис групи
+        f"""INSERT INTO duplicate_groups (file_hash, canonical_id, member_count)
+            SELECT file_hash,
+                   COALESCE(MIN(CASE WHEN {_has_metadata_sql('documents')} THEN id END), MIN(id)),
+                   COUNT(*)
+              FROM documents
+             WHERE {_full_hash_sql('file_hash')}
+             GROUP BY file_hash""",
+    ]
+    if cur is not None:
+        for stmt in sql:
+            cur.execute(stmt)
+        return
+    with db.transaction():
+        cur = db._conn.cursor()
+        for stmt in sql:
+            cur.execute(stmt)
+
+
+# mtime у цілих наносекундах для ключа file_fingerprints (last_modified зберігається як REAL)
+def _mtime_ns_sql(col):
+    return f"CAST(round({col} * 1000000000) AS INTEGER)"
+
+
+def _remember_fingerprints(cur):
+    """Заносить повні хеші записів hash_batch у кеш file_fingerprints."""
+    cur.execute(f"""
+        INSERT INTO file_fingerprints (size, mtime_ns, inode, file_hash, used_at)
+        SELECT d.size, {_mtime_ns_sql('d.last_modified')}, d.inode, d.file_hash, ?
+          FROM hash_batch b CROSS JOIN documents d ON d.id = b.id
+         WHERE d.size IS NOT NULL AND d.last_modified IS NOT NULL AND d.inode
+           AND {_full_hash_sql('d.file_hash')}
+        ON CONFLICT (size, mtime_ns, inode) DO UPDATE SET
+            file_hash=excluded.file_hash, used_at=excluded.used_at
+    """, (time.time(),))
+
+
+def get_cached_hashes():
+    """
+    Хеші з кешу file_fingerprints для записів без file_hash, у яких збігаються
+    (size, mtime_ns, inode). Знайдені записи кешу позначаються як використані.
+
+    :return: list of tuples (id, file_hash)
+    """
+    match = f"""
+        FROM documents d JOIN file_fingerprints fp
+          ON fp.size = d.size AND fp.inode = d.inode
+         AND fp.mtime_ns = {_mtime_ns_sql('d.last_modified')}
+       WHERE d.file_hash IS NULL
+    """
+    with db.transaction():
+        cur = db._conn.cursor()
+        rows = cur.execute(f"SELECT d.id, fp.file_hash {match}").fetchall()
+        if rows:
+            cur.execute(f"""
+                UPDATE file_fingerprints SET used_at=?
+                 WHERE (size, mtime_ns, inode) IN (SELECT fp.size, fp.mtime_ns, fp.inode {match})
+            """, (time.time(),))
+    return rows
+
+
+def get_same_file_hashes(ids):
+    """
+    Наявні хеші інших записів того самого незміненого файлу (той же inode,
+    size, mtime — жорсткі посилання, повторні записи) для ids одним запитом.
+    :return: dict {id: list of file_hash}
+    """
+    if not ids:
+        return {}
+    rows = db.query(
+        """
+        SELECT n.id, k.file_hash
+          FROM documents n JOIN documents k
+            ON k.inode = n.inode AND k.size = n.size AND k.last_modified = n.last_modified
+         WHERE n.id IN (SELECT value FROM json_each(?))
+           AND k.id != n.id AND k.file_hash IS NOT NULL
+        """, (_json_list(ids),)
+    )
+    result = {}
+    for doc_id, fh in rows:
+        result.setdefault(doc_id, []).append(fh)
+    return result
+
+
+def evict_fingerprints(max_entries=FINGERPRINT_CACHE_SIZE, max_age=FINGERPRINT_CACHE_AGE):
+    """
+    Видаляє з кешу file_fingerprints записи, не використані max_age секунд,
+    і найдавніше використані понад max_entries.
+    :return: кількість видалених записів
+    """
+    with db.transaction():
+        cur = db._conn.cursor()
+        cur.execute("DELETE FROM file_fingerprints WHERE used_at < ?", (time.time() - max_age,))
+        removed = cur.rowcount
+        cur.execute("""
+            DELETE FROM file_fingerprints WHERE rowid IN (
+                SELECT rowid FROM file_fingerprints ORDER BY used_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (max_entries,))
+        removed += cur.rowcount
+    return removed
 
 
 def get_new_files_count():
@@ -117,6 +974,41 @@ def mark_all_as_old():
     db.execute("UPDATE documents SET is_new=0 WHERE is_new=1")
 
 
+def normalize_term(term):
+    """Пошуковий рядок у вигляді для fts_query / search_match_sql."""
+    return (term or '').strip().lower()
+
+
+def fts_query(term):
+    """
+    Рядок пошуку для documents_fts MATCH: term як одна фраза (пошук підрядка
+    у будь-якій колонці індексу, без урахування регістру).
+    Має сенс лише для term довжиною від FTS_MIN_TERM символів.
+    """
+    return '"' + term.replace('"', '""') + '"'
+
+
+def search_documents(term, exclude_id=None):
+    """
+    Документи, що містять term (найрелевантніші першими; порожній term — усі):
+    list of tuples (id, filename)
+    """
+    term = normalize_term(term)
+    if len(term) >= FTS_MIN_TERM and search_index_ready():
+        return db.query(
+            "SELECT d.id, d.filename FROM documents_fts f JOIN documents d ON d.id = f.rowid "
+            "WHERE documents_fts MATCH ? AND d.id IS NOT ? ORDER BY f.rank",
+            (fts_query(term), exclude_id)
+        )
+    if not term:
+        return db.query("SELECT id, filename FROM documents WHERE id IS NOT ?", (exclude_id,))
+    # Коротке слово (або SQLite без FTS5): без індексу, ulower — див. Database
+    return db.query(
+        f"SELECT d.id, d.filename FROM documents d WHERE d.id IS NOT ? AND {search_match_sql('d')}",
+        (exclude_id, term, term)
+    )
+
+
 def get_document_numbers(doc_id):
     return db.query(
         "SELECT number_type, number_value FROM document_numbers WHERE document_id=?", (doc_id,)
@@ -145,19 +1037,35 @@ def get_linked_count(doc_id):
     return row[0][0] if row else 0
 
 
-def get_linked_docs(doc_id):
-    direct = db.query(
-        "SELECT to_doc_id, link_type FROM document_links WHERE from_doc_id=?", (doc_id,)
-    )
-    rev_raw = db.query(
-        "SELECT from_doc_id, link_type FROM document_links WHERE to_doc_id=?", (doc_id,)
+def get_links_for(ids):
+    """
+    Зв'язки записів ids одним запитом (зворотні — з оберненим типом).
+    :return: dict {id: list of tuples (other_id, filename, link_type)}
+    """
+    if not ids:
+        return {}
+    rows = db.query(
+        """
+        SELECT dl.from_doc_id, dl.to_doc_id, d.filename, dl.link_type, 0 AS rev, dl.id
+          FROM document_links dl JOIN documents d ON d.id = dl.to_doc_id
+         WHERE dl.from_doc_id IN (SELECT value FROM json_each(?1))
+        UNION ALL
+        SELECT dl.to_doc_id, dl.from_doc_id, d.filename, dl.link_type, 1 AS rev, dl.id
+          FROM document_links dl JOIN documents d ON d.id = dl.from_doc_id
+         WHERE dl.to_doc_id IN (SELECT value FROM json_each(?1))
+        ORDER BY 5, 6
+        """, (_json_list(ids),)
     )
-    reverse = [(other, REVERSE_LINKS.get(lt, lt)) for other, lt in rev_raw]
+    results = {doc_id: [] for doc_id in ids}
     seen = set()
-    results = []
-    for other_id, lt in direct + reverse:
-        if other_id not in seen:
-            seen.add(other_id)
-            fn = db.query("SELECT filename FROM documents WHERE id=?", (other_id,))[0][0]
-            results.append((other_id, fn, lt))
-    return results
\ No newline at end of file
+    for doc_id, other_id, fn, lt, rev, _ in rows:
+        # Прямий зв'язок має перевагу над зворотним до того ж документа
+        if (doc_id, other_id) in seen:
+            continue
+        seen.add((doc_id, other_id))
+        results[doc_id].append((other_id, fn, REVERSE_LINKS.get(lt, lt) if rev else lt))
+    return results
+
+
+def get_linked_docs(doc_id):
+    return get_links_for([doc_id])[doc_id]
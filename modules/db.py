@@ -1,19 +1,36 @@
+import queue
 import sqlite3
 import threading
 from contextlib import contextmanager
+from pathlib import Path
+
+
+def _ulower(value):
+    # Вбудований lower() SQLite змінює лише ASCII, тож кирилицю знижуємо через Python
+    return None if value is None else str(value).lower()
+
 
 class Database:
     """
-    Простіший обгортковий клас для роботи з SQLite з довгоживим підключенням.
+    Простіший обгортковий клас для роботи з SQLite з довгоживими підключеннями.
     Підтримує паралельні запити завдяки check_same_thread=False.
 
+    Одне підключення-записувач (усі INSERT/UPDATE/DELETE і транзакції) послідовно
+    під блокуванням, а SELECT-запити виконуються через пул до max_readers
+    підключень лише для читання, тож у режимі WAL читання не чекають на запис
+    і одне на одне. Запити всередині transaction() на тому ж потоці йдуть через
+    записувач, щоб бачити незафіксовані зміни.
+
     Налаштування PRAGMA для оптимізації продуктивності:
       - journal_mode=WAL для кращої конкурентності
       - synchronous=NORMAL для балансування надійності та швидкості
       - temp_store=MEMORY для роботи з тимчасовими таблицями в пам’яті
       - cache_size=-2000 для збільшення кешу до ~2MB
+
+    На кожному підключенні зареєстровано функцію ulower(text) — lower() з
+    підтримкою Unicode для пошуку без урахування регістру.
     """
-    def __init__(self, path: str):
+    def __init__(self, path: str, max_readers: int = 4):
         self.path = path
         # Створюємо довгоживе підключення
         self._conn = sqlite3.connect(self.path, check_same_thread=False)
@@ -22,46 +39,112 @@ class Database:
         self._conn.execute("PRAGMA synchronous=NORMAL;")
         self._conn.execute("PRAGMA temp_store = MEMORY;")
         self._conn.execute("PRAGMA cache_size = -2000;")
-        # Блокування для безпечного доступу з декількох потоків
-        self._lock = threading.Lock()
+        self._register_functions(self._conn)
+        # Блокування записувача (повторне — для запитів усередині транзакції)
+        self._lock = threading.RLock()
+        # Стан транзакції поточного потоку
+        self._local = threading.local()
+        # Пул підключень для читання (створюються за потреби)
+        self.max_readers = max(1, int(max_readers))
+        self._readers = queue.LifoQueue()
+        self._all_readers = []
+        self._readers_lock = threading.Lock()
 
     def close(self) -> None:
         """
         Закриває з’єднання з базою даних.
         """
+        with self._readers_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers = []
+            self._readers = queue.LifoQueue()
         with self._lock:
             if self._conn:
                 self._conn.close()
                 self._conn = None
 
+    @staticmethod
+    def _register_functions(conn):
+        conn.create_function("ulower", 1, _ulower, deterministic=True)
+
+    def _in_transaction(self) -> bool:
+        return getattr(self._local, "depth", 0) > 0
+
     @contextmanager
     def transaction(self):
         """
         Контекст для транзакцій. Виконує commit після успіху або rollback при виключенні.
+        Вкладені transaction() на тому ж потоці стають частиною зовнішньої.
         """
         with self._lock:
+            depth = getattr(self._local, "depth", 0)
+            self._local.depth = depth + 1
             try:
                 yield
-                self._conn.commit()
+                if depth == 0:
+                    self._conn.commit()
             except:
-                self._conn.rollback()
+                if depth == 0:
+                    self._conn.rollback()
                 raise
+            finally:
+                self._local.depth = depth
+
+    def _open_reader(self):
+        uri = Path(self.path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        conn.execute("PRAGMA cache_size = -2000;")
+        self._register_functions(conn)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """
+        Підключення лише для читання з пулу (для кількох запитів поспіль).
+        Якщо всі max_readers підключень зайняті, чекає на звільнення.
+        Усередині transaction() повертає записувач.
+        """
+        if self._in_transaction():
+            with self._lock:
+                yield self._conn
+            return
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._readers_lock:
+                if len(self._all_readers) < self.max_readers:
+                    conn = self._open_reader()
+                    self._all_readers.append(conn)
+            if conn is None:
+                conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            # Завершуємо неявну транзакцію читання, щоб наступний запит бачив свіжі дані
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
 
     def query(self, sql: str, params: tuple = ()) -> list:
         """
         Виконує SELECT-запит і повертає всі рядки.
         """
-        with self._lock:
-            cur = self._conn.execute(sql, params)
+        with self.reader() as conn:
+            cur = conn.execute(sql, params)
             return cur.fetchall()
 
     def execute(self, sql: str, params: tuple = ()) -> int:
         """
         Виконує INSERT/UPDATE/DELETE і повертає lastrowid.
+        Усередині transaction() commit виконує сама транзакція.
         """
         with self._lock:
             cur = self._conn.execute(sql, params)
-            self._conn.commit()
+            if not self._in_transaction():
+                self._conn.commit()
             return cur.lastrowid
 
     def executemany(self, sql: str, seq_of_params: list) -> int:
@@ -70,7 +153,8 @@ class Database:
         """
         with self._lock:
             cur = self._conn.executemany(sql, seq_of_params)
-            self._conn.commit()
+            if not self._in_transaction():
+                self._conn.commit()
             return cur.rowcount
 
     def __del__(self):
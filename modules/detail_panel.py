@@ -9,8 +9,9 @@ from tkcalendar import DateEntry
 from .database import (
     db,
     get_linked_docs,
-    get_document_numbers,
-    save_document_numbers
+    get_documents,
+    update_documents,
+    delete_documents
 )
 from .utils import rename_file, delete_file
 from .context_menu import build_context_menu, open_selected
@@ -212,44 +213,34 @@ class DetailPanel(tk.Frame):
 
         try:
             ids = self.bulk_ids if self.bulk_ids else [self.doc_id]
-            for did in ids:
-                # Перевірка існування документа перед будь-якою дією
-                row = db.query("SELECT filepath FROM documents WHERE id=?", (did,))
-                if not row:
-                    continue
-                filepath = row[0][0]
-
+            # Перевірка існування документів перед будь-якою дією
+            paths = get_documents(ids, ('filepath',))
+            ids = [did for did in ids if did in paths]
+            with db.transaction():
                 # У bulk-режимі не змінюємо назву файлу
-                if not self.bulk_ids:
+                if not self.bulk_ids and ids:
+                    did = ids[0]
+                    filepath = paths[did][0]
                     base = self._fields["filename"].get().strip()
                     if base and filepath:
                         if os.path.exists(filepath):
                             ext = os.path.splitext(filepath)[1]
                             new_name = base + ext
                             new_path = rename_file(filepath, new_name)
-                            db.execute("UPDATE documents SET filename=?, filepath=? WHERE id=?",
-                                       (new_name, new_path, did))
-
-                params = (
-                    self._fields["status"].get().strip(),
-                    self._fields["doc_type"].get().strip(),
-                    self._fields["doc_number"].get().strip(),
-                    self._fields["doc_date"].get_date().isoformat(),
-                    self._fields["sender"].get().strip(),
-                    self._fields["tags"].get().strip(),
-                    int(self._fields["is_controlled_var"].get()),
-                    (self._fields["deadline"].get_date().isoformat()
-                     if self._fields["is_controlled_var"].get() else None),
-                    self._fields["description"].get("1.0", "end-1c").strip(),
-                    did
-                )
-                db.execute(
-                    "UPDATE documents SET status=?,doc_type=?,doc_number=?,doc_date=?,sender=?,tags=?,is_controlled=?,deadline=?,description=? WHERE id=?",
-                    params
-                )
-
-                nums = get_document_numbers(did)
-                save_document_numbers(did, nums)
+                            update_documents([did], {'filename': new_name, 'filepath': new_path})
+
+                update_documents(ids, {
+                    'status': self._fields["status"].get().strip(),
+                    'doc_type': self._fields["doc_type"].get().strip(),
+                    'doc_number': self._fields["doc_number"].get().strip(),
+                    'doc_date': self._fields["doc_date"].get_date().isoformat(),
+                    'sender': self._fields["sender"].get().strip(),
+                    'tags': self._fields["tags"].get().strip(),
+                    'is_controlled': int(self._fields["is_controlled_var"].get()),
+                    'deadline': (self._fields["deadline"].get_date().isoformat()
+                                 if self._fields["is_controlled_var"].get() else None),
+                    'description': self._fields["description"].get("1.0", "end-1c").strip(),
+                })
 
         except Exception as e:
             import traceback
@@ -270,8 +261,13 @@ class DetailPanel(tk.Frame):
             full = os.path.join(DOCUMENTS_DIR, self.folder_rel)
             if not messagebox.askyesno("Підтвердження", f"Видалити папку та усі файли?\n{full}"):
                 return
-            db.execute("DELETE FROM documents WHERE folder=? OR folder LIKE ?",
-                       (self.folder_rel, f"{self.folder_rel}{os.sep}%"))
+            # Діапазон замість LIKE: працює через idx_documents_folder
+            # і не трактує '_' та '%' у назвах папок як шаблон
+            prefix = f"{self.folder_rel}{os.sep}"
+            rows = db.query("SELECT id FROM documents WHERE folder=? OR (folder>=? AND folder<?)",
+                            (self.folder_rel, prefix, prefix[:-1] + chr(ord(os.sep) + 1)))
+            # Разом з номерами та зв'язками записів
+            delete_documents([doc_id for doc_id, in rows])
             try:
                 shutil.rmtree(full)
             except Exception as e:
@@ -285,15 +281,13 @@ class DetailPanel(tk.Frame):
             count = len(ids)
             if not messagebox.askyesno("Підтвердження", f"Видалити {count} файлів?" ):
                 return
-            with db.transaction():
-                for did in ids:
-                    old = db.query("SELECT filepath FROM documents WHERE id=?", (did,))[0][0]
-                    db.execute("DELETE FROM document_numbers WHERE document_id=?", (did,))
-                    db.execute("DELETE FROM documents WHERE id=?", (did,))
-                    if os.path.exists(old):
-                        try: delete_file(old)
-                        except PermissionError:
-                            messagebox.showerror("Помилка", f"Не вдалося видалити файл {os.path.basename(old)}")
+            paths = get_documents(ids, ('filepath',))
+            delete_documents(ids)
+            for old, in paths.values():
+                if old and os.path.exists(old):
+                    try: delete_file(old)
+                    except PermissionError:
+                        messagebox.showerror("Помилка", f"Не вдалося видалити файл {os.path.basename(old)}")
             self.bulk_ids = None
             self.doc_id = None
             self._exit_bulk_mode()
@@ -3,7 +3,7 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 from tkcalendar import DateEntry
 
-from .database import db, get_document_numbers, save_document_numbers
+from .database import db, get_documents, update_documents, delete_documents
 from .utils import rename_file, delete_file
 
 
@@ -104,34 +104,31 @@ class EditWindow(tk.Toplevel):
         # TODO: додати додаткові номери з get_document_numbers
 
     def _on_save(self):
-        # Перейменування файлу
-        base = self._fields["filename"].get().strip()
-        if base:
-            old = db.query("SELECT filepath FROM documents WHERE id=?", (self.doc_id,))[0][0]
-            if os.path.exists(old):
+        paths = get_documents([self.doc_id], ('filepath',))
+        if self.doc_id not in paths:
+            self.destroy()
+            return
+        with db.transaction():
+            # Перейменування файлу
+            base = self._fields["filename"].get().strip()
+            old = paths[self.doc_id][0]
+            if base and old and os.path.exists(old):
                 new_name = base + os.path.splitext(old)[1]
                 new_path = rename_file(old, new_name)
-                db.execute("UPDATE documents SET filename=?, filepath=? WHERE id=?",
-                           (new_name, new_path, self.doc_id))
-        # Оновлення полів
-        data = (
-            self._fields["status"].get().strip(),
-            self._fields["doc_type"].get().strip(),
-            self._fields["doc_number"].get().strip(),
-            self._fields["doc_date"].get_date().isoformat(),
-            self._fields["sender"].get().strip(),
-            self._fields["tags"].get().strip(),
-            int(self._vars["is_controlled"].get()),
-            (self._fields["deadline"].get_date().isoformat()
-             if self._vars["is_controlled"].get() else None),
-            self._fields["description"].get("1.0", "end-1c").strip(),
-            self.doc_id
-        )
-        db.execute(
-            "UPDATE documents SET status=?,doc_type=?,doc_number=?,doc_date=?,sender=?,tags=?,is_controlled=?,deadline=?,description=? WHERE id=?",
-            data
-        )
-        save_document_numbers(self.doc_id, get_document_numbers(self.doc_id))
+                update_documents([self.doc_id], {'filename': new_name, 'filepath': new_path})
+            # Оновлення полів
+            update_documents([self.doc_id], {
+                'status': self._fields["status"].get().strip(),
+                'doc_type': self._fields["doc_type"].get().strip(),
+                'doc_number': self._fields["doc_number"].get().strip(),
+                'doc_date': self._fields["doc_date"].get_date().isoformat(),
+                'sender': self._fields["sender"].get().strip(),
+                'tags': self._fields["tags"].get().strip(),
+                'is_controlled': int(self._vars["is_controlled"].get()),
+                'deadline': (self._fields["deadline"].get_date().isoformat()
+                             if self._vars["is_controlled"].get() else None),
+                'description': self._fields["description"].get("1.0", "end-1c").strip(),
+            })
         self.destroy()
         if hasattr(self.master, "load_registry_data"):
             self.master.load_registry_data()
@@ -139,10 +136,11 @@ class EditWindow(tk.Toplevel):
     def _on_delete_file(self):
         if not messagebox.askyesno("Підтвердження", "Видалити файл?" ):
             return
-        db.execute("DELETE FROM document_numbers WHERE document_id=?", (self.doc_id,))
-        old = db.query("SELECT filepath FROM documents WHERE id=?", (self.doc_id,))[0][0]
-        db.execute("DELETE FROM documents WHERE id=?", (self.doc_id,))
-        if os.path.exists(old):
+        paths = get_documents([self.doc_id], ('filepath',))
+        # Разом з номерами та зв'язками запису
+        delete_documents([self.doc_id])
+        old = paths.get(self.doc_id, (None,))[0]
+        if old and os.path.exists(old):
             try:
                 delete_file(old)
             except PermissionError:
@@ -1,29 +1,425 @@
 import concurrent.futures
-from modules.database import db, propagate_metadata_for_hash
-from modules.utils import compute_file_hash
+import logging
+import os
+import queue
+import threading
+import time
+from modules.database import (
+    db, save_file_hashes, get_cached_hashes, evict_fingerprints, get_documents_by_sizes,
+    get_same_file_hashes
+)
+from modules.utils import (
+    compute_partial_hash, size_fingerprint, partial_fingerprint,
+    hash_algorithm, PARTIAL_FINGERPRINT_PREFIX, DEFAULT_HASH_ALGORITHM
+)
+from modules.hashing import HashEngine
+from modules.progress import ProgressReporter
 
+logger = logging.getLogger(__name__)
 
-def background_hash_updates(max_workers=4):
+# Кількість хешів, що записуються однією транзакцією
+HASH_BATCH_SIZE = 300
+# Як часто HashJob чистить кеш file_fingerprints (секунди)
+EVICT_INTERVAL = 24 * 3600
+
+
+class HashWriter:
+    """
+    Єдиний записувач результатів хешування.
+    Потоки хешування лише кладуть (id, file_hash) і розміри старих записів
+    без size (put_size) у чергу; окремий потік забирає їх батчами до batch_size
+    і записує однією транзакцією (save_file_hashes) разом із синхронізацією
+    метаданих дублікатів. Неповний батч записується, якщо нових результатів
+    немає flush_interval секунд.
+    """
+    def __init__(self, batch_size=HASH_BATCH_SIZE, flush_interval=0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.ids = []
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="hash-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, doc_id, file_hash):
+        self._queue.put((doc_id, file_hash, None))
+
+    def put_size(self, doc_id, size):
+        self._queue.put((doc_id, None, size))
+
+    def close(self):
+        """Дописує залишок черги і зупиняє потік; повторно піднімає помилку запису."""
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        batch = []
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._flush(batch)
+                continue
+            if item is None:
+                self._flush(batch)
+                return
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        if not batch or self._error is not None:
+            batch.clear()
+            return
+        hashes = [(doc_id, fh) for doc_id, fh, _ in batch if fh is not None]
+        sizes = [(doc_id, size) for doc_id, _, size in batch if size is not None]
+        try:
+            self.written += save_file_hashes(hashes, sizes)
+            self.ids.extend(doc_id for doc_id, _ in hashes)
+        except Exception as e:
+            logger.exception("Failed to save %d file hashes", len(batch))
+            self._error = e
+        batch.clear()
+
+
+def background_hash_updates(max_workers=4, progress_callback=None, tiered=True,
+                            engine='process', algorithm=DEFAULT_HASH_ALGORITHM, throttle=None,
+                            failed=None):
     """
-    Фонове обчислення SHA-256 хешів для нових записів і синхронізація метаданих дублікатів.
-    max_workers – кількість потоків для паралельної обробки.
+    Фонове обчислення хешів для нових записів і синхронізація метаданих дублікатів.
+    Файли з тими ж (size, mtime, inode), що й уже хешований запис або запис кешу
+    file_fingerprints, не читаються: хеш копіюється з нього.
+    Повні хеші рахує HashEngine; запис у БД виконує один HashWriter батчами.
+    max_workers – кількість процесів (потоків) для паралельної обробки.
+    progress_callback – функція progress_callback(Progress), викликається з обмеженою частотою.
+    tiered – ступінчасте хешування: дублікатами можуть бути лише файли однакового
+             розміру, тож повний хеш рахується тільки при збігу часткових хешів
+             (див. _tiered_fingerprints); інакше — повний хеш кожного файлу.
+    engine – 'process' або 'thread' (див. HashEngine).
+    algorithm – алгоритм повного хешу; наявні повні хеші іншого алгоритму
+                у групах можливих дублікатів перераховуються.
+    throttle – необов'язкова функція throttle(nbytes), що викликається перед читанням
+               кожного файлу (пауза, обмеження I/O; див. HashJob).
+    failed – необов'язковий dict {id: last_modified} записів, файли яких не вдалося
+             прочитати; такі записи не перечитуються, доки не зміниться mtime,
+             а нові невдачі додаються в нього.
+    :return: list of id записів, яким записано хеш
     """
+    # Хеші файлів, що не змінились з моменту попереднього хешування (кеш file_fingerprints)
+    cached = [(doc_id, fh) for doc_id, fh in get_cached_hashes() if hash_algorithm(fh) == algorithm]
+    save_file_hashes(cached)
+
     # Отримуємо всі записи без file_hash
-    rows = db.query("SELECT id, filepath FROM documents WHERE file_hash IS NULL")
+    rows = db.query(
+        "SELECT id, filepath, size, last_modified, inode FROM documents WHERE file_hash IS NULL"
+    )
+    if failed is None:
+        failed = {}
+    elif failed:
+        rows = [row for row in rows if row[0] not in failed or failed[row[0]] != row[3]]
+    progress = ProgressReporter(progress_callback, len(rows), name="hash", logger=logger)
+    progress.start()
+
+    writer = HashWriter()
+    try:
+        with HashEngine(engine, max_workers, algorithm) as hasher:
+            if tiered:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    _tiered_fingerprints(rows, executor, writer, hasher, progress, throttle, failed)
+            else:
+                _full_fingerprints(rows + _stale_duplicates(rows, algorithm),
+                                   set(r[0] for r in rows), writer, hasher, progress, throttle,
+                                   failed)
+    finally:
+        writer.close()
+    progress.finish()
+    return [doc_id for doc_id, _ in cached] + writer.ids
+
+
+def _full_fingerprints(rows, pending, writer, hasher, progress, throttle=None, failed=None):
+    """
+    Повні хеші записів rows (id, filepath, size, last_modified, inode) з передачею у writer.
+    Файл читається один раз на (inode, size, mtime): жорсткі посилання та записи,
+    для яких хеш уже відомий, не перераховуються.
+    pending – id записів, що враховуються в прогресі.
+    failed – dict {id: last_modified}, куди додаються записи недоступних файлів.
+    """
+    groups = {}
+    for row in rows:
+        doc_id, path, size, last_mod, inode = row
+        key = (inode, size, last_mod) if inode and size is not None else ('id', doc_id)
+        groups.setdefault(key, []).append(row)
+
+    # Хеші того самого файлу, уже обчислені для інших записів (один запит на всі групи)
+    known = get_same_file_hashes([g[0][0] for key, g in groups.items() if key[0] != 'id'])
+    todo = []
+    for key, group in groups.items():
+        fh = next((h for h in known.get(group[0][0], ())
+                   if hash_algorithm(h) == hasher.algorithm), None)
+        if fh is None:
+            todo.append(group)
+            continue
+        for row in group:
+            writer.put(row[0], fh)
+            if row[0] in pending:
+                progress.advance()
+
+    results = hasher.map([g[0][1] for g in todo], [g[0][2] for g in todo], throttle)
+    for group, fh in zip(todo, results):
+        progress.advance(0, group[0][2] or 0)
+        for row in group:
+            if fh is not None:
+                writer.put(row[0], fh)
+            elif failed is not None:
+                failed[row[0]] = row[3]
+            if row[0] in pending:
+                progress.advance()
+
+
+def _stale_duplicates(rows, algorithm):
+    """
+    Хешовані записи (id, filepath, size, last_modified, inode) з тими ж розмірами,
+    що й rows, відбиток яких не можна порівняти з повним хешем algorithm
+    (інший алгоритм або "size:"/"part:"). Як і в _tiered_fingerprints, такі
+    можливі дублікати перераховуються тим самим алгоритмом.
+    """
+    ids = {row[0] for row in rows}
+    stale = []
+    for size, members in get_documents_by_sizes({row[2] for row in rows if row[2] is not None}).items():
+        if len(members) < 2:
+            continue
+        for doc_id, path, size, last_mod, inode, fh in members:
+            if doc_id not in ids and fh is not None and hash_algorithm(fh) != algorithm:
+                stale.append((doc_id, path, size, last_mod, inode))
+    return stale
+
+
+def _tiered_fingerprints(rows, executor, writer, hasher, progress, throttle=None, failed=None):
+    """
+    Ступінчасте хешування записів rows (id, filepath, size, last_modified, inode).
 
-    def worker(row):
-        doc_id, path = row
+    1) Файл, розмір якого унікальний у реєстрі, отримує відбиток "size:<розмір>" без читання.
+    2) Для груп однакового розміру рахуються часткові хеші (перші та останні 64 КБ);
+       файл з унікальним частковим хешем отримує відбиток "part:<розмір>:<хеш>".
+    3) Лише при збігу часткових хешів рахується повний хеш (hasher).
+    Відбитки наявних записів тієї ж групи за потреби уточнюються (size: → part: → повний).
+    Результати передаються у writer, записи недоступних файлів — у failed.
+    """
+    pending = {}
+    # Записи без size (старі): розмір з диска, у БД — через writer
+    missing_sizes = {}
+    for doc_id, path, size, last_mod, inode in rows:
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                if failed is not None:
+                    failed[doc_id] = last_mod
+                progress.advance()
+                continue
+            missing_sizes[doc_id] = size
+            writer.put_size(doc_id, size)
+        pending[doc_id] = (doc_id, path, size, last_mod, inode)
+
+    groups = get_documents_by_sizes({row[2] for row in pending.values()})
+    for doc_id, size in missing_sizes.items():
+        # У БД їхній size ще не записано
+        groups.setdefault(size, []).append((*pending[doc_id], None))
+        groups[size].sort()
+
+    partial_jobs = []
+    for size, members in groups.items():
+        if len(members) == 1:
+            writer.put(members[0][0], size_fingerprint(size))
+            progress.advance()
+            continue
+        partial_jobs.append(members)
+
+    def partial_for(member):
+        doc_id, path, size, last_mod, inode, fh = member
+        if fh and fh.startswith(PARTIAL_FINGERPRINT_PREFIX):
+            return fh.rsplit(':', 1)[1]
+        if throttle is not None:
+            throttle(min(size, 128 * 1024))
         try:
-            # Обчислюємо хеш файлу
-            fh = compute_file_hash(path)
-            # Оновлюємо поле file_hash
-            db.execute("UPDATE documents SET file_hash=? WHERE id=?", (fh, doc_id))
-            # Синхронізуємо метадані дублікатів за хешем
-            propagate_metadata_for_hash(fh, doc_id)
-        except Exception:
-            # Ігноруємо помилки I/O або відсутності файлу
-            pass
+            digest = compute_partial_hash(path, size)
+        except OSError:
+            return None
+        progress.advance(0, min(size, 128 * 1024))
+        return digest
+
+    full_jobs = []
+    for members, partials in zip(
+            partial_jobs,
+            executor.map(lambda ms: [partial_for(m) for m in ms], partial_jobs)):
+        clusters = {}
+        for member, digest in zip(members, partials):
+            if digest is not None:
+                clusters.setdefault(digest, []).append(member)
+            elif member[0] in pending:
+                if failed is not None:
+                    failed[member[0]] = member[3]
+                progress.advance()
+        for digest, cluster in clusters.items():
+            if len(cluster) == 1:
+                doc_id, _, size, _, _, fh = cluster[0]
+                if hash_algorithm(fh) is None:
+                    writer.put(doc_id, partial_fingerprint(size, digest))
+                if doc_id in pending:
+                    progress.advance()
+                continue
+            # Можливі дублікати — потрібен повний хеш (одного алгоритму для всієї групи)
+            for member in cluster:
+                if hash_algorithm(member[5]) != hasher.algorithm:
+                    full_jobs.append(member[:5])
+                elif member[0] in pending:
+                    progress.advance()
+
+    _full_fingerprints(full_jobs, pending, writer, hasher, progress, throttle, failed)
+
+
+class HashCancelled(Exception):
+    """Фонове хешування зупинено (HashJob.stop)."""
+
+
+class HashJob:
+    """
+    Керована фонова задача хешування.
+
+    Потік виконує background_hash_updates, а після завершення чекає на wake()
+    (сканування, спостерігач чи фонова перевірка stat знайшли записи без хешу)
+    і лише тоді повторює прохід. Записи файлів, які не вдалося прочитати,
+    запам'ятовуються разом з mtime і не перечитуються, доки файл не зміниться.
+    Кеш file_fingerprints чиститься після першого проходу і далі не частіше
+    ніж раз на EVICT_INTERVAL. Перед читанням кожного файлу викликається throttle():
+      - на паузі (pause/resume) читання не починається;
+      - протягом idle_delay секунд після touch() (дії користувача в UI) хешування
+        відступає, щоб не заважати інтерфейсу;
+      - при mb_per_sec > 0 швидкість читання обмежується відром токенів.
+    Уже обчислені хеші записуються батчами, тож зупинка не втрачає результатів:
+    наступний прохід продовжить із записів без хешу.
+    """
+    def __init__(self, progress_callback=None, done_callback=None, workers=4, mb_per_sec=0,
+                 engine='process', algorithm=DEFAULT_HASH_ALGORITHM, idle_delay=1.5):
+        self.progress_callback = progress_callback
+        self.done_callback = done_callback
+        self.workers = workers
+        self.engine = engine
+        self.algorithm = algorithm
+        self.idle_delay = idle_delay
+        self._failed = {}
+        self._evicted_at = None
+        self._cond = threading.Condition()
+        self._rate = 0.0
+        self._tokens = 0.0
+        self._refilled = time.monotonic()
+        self._paused = False
+        self._stopped = False
+        self._wake = False
+        self._last_activity = 0.0
+        self._thread = None
+        self.set_budget(mb_per_sec)
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="hash-job", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def pause(self):
+        with self._cond:
+            self._paused = True
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+            self._cond.notify_all()
+
+    def wake(self):
+        """Запускає новий прохід (з'явились записи без хешу)."""
+        with self._cond:
+            self._wake = True
+            self._cond.notify_all()
 
-    # Паралельна обробка у потоках
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        executor.map(worker, rows)
+    def touch(self):
+        """Позначає активність користувача: хешування відступає на idle_delay секунд."""
+        self._last_activity = time.monotonic()
+
+    def set_budget(self, mb_per_sec):
+        """Ліміт читання в МБ/с (0 — без обмеження)."""
+        with self._cond:
+            self._rate = max(0.0, float(mb_per_sec or 0)) * 1024 * 1024
+            self._tokens = 0.0
+            self._refilled = time.monotonic()
+
+    def throttle(self, nbytes):
+        with self._cond:
+            while True:
+                if self._stopped:
+                    raise HashCancelled()
+                if self._paused:
+                    self._cond.wait()
+                    continue
+                idle = time.monotonic() - self._last_activity
+                if idle < self.idle_delay:
+                    self._cond.wait(self.idle_delay - idle)
+                    continue
+                break
+            if not self._rate:
+                return
+            now = time.monotonic()
+            # Запас токенів не більший за секунду читання
+            self._tokens = min(self._rate, self._tokens + (now - self._refilled) * self._rate)
+            self._refilled = now
+            self._tokens -= nbytes
+            delay = -self._tokens / self._rate if self._tokens < 0 else 0.0
+            if delay:
+                self._cond.wait(delay)
+                if self._stopped:
+                    raise HashCancelled()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                ids = background_hash_updates(
+                    self.workers, self.progress_callback,
+                    engine=self.engine, algorithm=self.algorithm, throttle=self.throttle,
+                    failed=self._failed
+                )
+            except HashCancelled:
+                break
+            except Exception:
+                logger.exception("Background hashing failed")
+            else:
+                self._evict()
+                if self.done_callback:
+                    self.done_callback(ids)
+            with self._cond:
+                self._cond.wait_for(lambda: self._wake or self._stopped)
+                self._wake = False
+
+    def _evict(self):
+        now = time.monotonic()
+        if self._evicted_at is not None and now - self._evicted_at < EVICT_INTERVAL:
+            return
+        self._evicted_at = now
+        try:
+            evict_fingerprints()
+        except Exception:
+            logger.exception("Fingerprint cache eviction failed")
@@ -0,0 +1,17 @@
+"""
+Виконавець пулу процесів HashEngine.
+
+На Windows пул запускає процеси через spawn: кожен дочірній процес заново
+імпортує модуль цільової функції. Тому тут лише читання файлу (modules.utils)
+без БД та UI — процеси пулу не відкривають підключення до БД і не створюють вікон.
+"""
+from modules.utils import compute_file_hash
+
+
+def hash_or_none(path, algorithm, mode, buffer_size):
+    """Відбиток compute_file_hash або None для недоступного файлу."""
+    try:
+        return compute_file_hash(path, buffer_size, algorithm, mode)
+    except OSError:
+        # Ігноруємо помилки I/O або відсутності файлу
+        return None
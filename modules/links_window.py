@@ -1,8 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 
-from config import DB_PATH
-from .database import db
+from .database import db, search_documents, get_links_for
 from .utils import delete_file
 
 LINK_TYPES = [
@@ -55,11 +54,6 @@ class LinksWindow(tk.Toplevel):
         self.geometry("900x450")
         self.doc_id = int(doc_id)
 
-        # Відкрити з’єднання з БД на весь життєвий цикл
-        self._conn_ctx = db._get_connection()
-        self.conn = self._conn_ctx.__enter__()
-        self.cur = self.conn.cursor()
-
         container = tk.Frame(self)
         container.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
@@ -108,46 +102,16 @@ class LinksWindow(tk.Toplevel):
         self._populate_all()
         self._populate_links()
 
-    def destroy(self):
-        try:
-            self.conn.commit()
-            self._conn_ctx.__exit__(None, None, None)
-        except Exception:
-            pass
-        super().destroy()
-
     def _populate_all(self):
-        term = self.search_var.get().lower()
+        term = self.search_var.get().strip()
         self.all_tree.delete(*self.all_tree.get_children())
-        self.cur.execute(
-            "SELECT id, filename, status, doc_type, doc_number, doc_date, sender, tags, description FROM documents WHERE id!=?",
-            (self.doc_id,)
-        )
-        for did, fn, status, typ, num, date, sender, tags, desc in self.cur.fetchall():
-            flat = " ".join(filter(None, [fn, status, typ, num, date, sender, tags, desc])).lower()
-            if term and term not in flat:
-                continue
+        for did, fn in search_documents(term, exclude_id=self.doc_id):
             self.all_tree.insert("", "end", iid=str(did), values=(did, fn))
 
     def _populate_links(self):
-        links_map = {}
-        # прямі
-        self.cur.execute(
-            "SELECT to_doc_id, filename, link_type FROM document_links dl JOIN documents d ON d.id=dl.to_doc_id WHERE dl.from_doc_id=?",
-            (self.doc_id,)
-        )
-        for did, fn, lt in self.cur.fetchall():
-            links_map[did] = (fn, lt)
-        # зворотні
-        self.cur.execute(
-            "SELECT from_doc_id, filename, link_type FROM document_links dl JOIN documents d ON d.id=dl.from_doc_id WHERE dl.to_doc_id=?",
-            (self.doc_id,)
-        )
-        for did, fn, lt in self.cur.fetchall():
-            links_map[did] = (fn, lt)
-
+        # прямі та зворотні зв'язки одним запитом
         self.links_tree.delete(*self.links_tree.get_children())
-        for did, (fn, lt) in links_map.items():
+        for did, fn, lt in get_links_for([self.doc_id])[self.doc_id]:
             self.links_tree.insert("", "end", iid=f"l{did}", values=(did, fn, lt))
 
     def _add(self):
@@ -157,25 +121,24 @@ class LinksWindow(tk.Toplevel):
         lt  = self.link_type.get()
         rev = REVERSE_LINKS.get(lt, lt)
         to_add = [int(i) for i in sel]
-        for other in to_add:
-            # перевірити існування зв’язку
-            self.cur.execute(
-                "SELECT 1 FROM document_links WHERE (from_doc_id=? AND to_doc_id=?) OR (from_doc_id=? AND to_doc_id=?)",
-                (self.doc_id, other, other, self.doc_id)
-            )
-            if self.cur.fetchone():
-                continue
-            # вставка прямого
-            self.cur.execute(
-                "INSERT INTO document_links (from_doc_id,to_doc_id,link_type) VALUES (?,?,?)",
-                (self.doc_id, other, lt)
-            )
-            # вставка зворотного
-            self.cur.execute(
-                "INSERT INTO document_links (from_doc_id,to_doc_id,link_type) VALUES (?,?,?)",
-                (other, self.doc_id, rev)
-            )
-        self.conn.commit()
+        with db.transaction():
+            for other in to_add:
+                # перевірити існування зв’язку
+                if db.query(
+                    "SELECT 1 FROM document_links WHERE (from_doc_id=? AND to_doc_id=?) OR (from_doc_id=? AND to_doc_id=?)",
+                    (self.doc_id, other, other, self.doc_id)
+                ):
+                    continue
+                # вставка прямого
+                db.execute(
+                    "INSERT INTO document_links (from_doc_id,to_doc_id,link_type) VALUES (?,?,?)",
+                    (self.doc_id, other, lt)
+                )
+                # вставка зворотного
+                db.execute(
+                    "INSERT INTO document_links (from_doc_id,to_doc_id,link_type) VALUES (?,?,?)",
+                    (other, self.doc_id, rev)
+                )
         self._populate_links()
 
     def _remove(self):
@@ -183,10 +146,8 @@ class LinksWindow(tk.Toplevel):
         if not sel:
             return
         to_remove = [int(i[1:]) for i in sel]
-        for other in to_remove:
-            self.cur.execute(
-                "DELETE FROM document_links WHERE (from_doc_id=? AND to_doc_id=?) OR (from_doc_id=? AND to_doc_id=?)",
-                (self.doc_id, other, other, self.doc_id)
-            )
-        self.conn.commit()
+        db.executemany(
+            "DELETE FROM document_links WHERE (from_doc_id=? AND to_doc_id=?) OR (from_doc_id=? AND to_doc_id=?)",
+            [(self.doc_id, other, other, self.doc_id) for other in to_remove]
+        )
         self._populate_links()
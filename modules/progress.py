@@ -0,0 +1,112 @@
+# modules/progress.py
+
+import logging
+import threading
+import time
+from collections import namedtuple
+
+
+class Progress(namedtuple("Progress", "done total bytes elapsed rate mb_rate eta")):
+    """
+    Знімок прогресу довгої операції.
+    done/total — оброблено/всього одиниць (total=0, якщо невідомо),
+    rate — одиниць/с, mb_rate — МБ/с, eta — секунд до завершення або None.
+    """
+    __slots__ = ()
+
+    def describe(self):
+        parts = [f"{self.done}/{self.total}" if self.total else str(self.done)]
+        if self.rate:
+            parts.append(f"{self.rate:.0f} ф/с")
+        if self.mb_rate:
+            parts.append(f"{self.mb_rate:.1f} МБ/с")
+        if self.eta is not None:
+            parts.append(f"≈{format_eta(self.eta)}")
+        return " · ".join(parts)
+
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} год {seconds % 3600 // 60} хв"
+    if seconds >= 60:
+        return f"{seconds // 60} хв {seconds % 60} с"
+    return f"{seconds} с"
+
+
+class ProgressReporter:
+    """
+    Спільний звітувач прогресу для сканування, хешування та інших фонових задач.
+
+    Рахує оброблені одиниці та байти, але викликає callback(Progress) не частіше
+    max_rate разів на секунду, а в лог пише не частіше, ніж раз на log_interval
+    секунд, тож кількість оновлень UI не залежить від кількості файлів.
+    Потокобезпечний: advance можна викликати з кількох потоків.
+    """
+    def __init__(self, callback=None, total=0, max_rate=4.0, name="progress",
+                 logger=None, log_interval=5.0, done=0):
+        self.callback = callback
+        self.total = total
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+        self._min_interval = 1.0 / max_rate if max_rate else 0.0
+        self._log_interval = log_interval
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._last_emit = 0.0
+        self._last_log = self._start
+        # done — уже оброблені раніше одиниці (продовження перерваної задачі);
+        # у швидкість і ETA вони не входять
+        self.done = done
+        self._initial = done
+        self.bytes = 0
+
+    def set_total(self, total):
+        with self._lock:
+            self.total = total
+
+    def advance(self, count=1, nbytes=0):
+        with self._lock:
+            self.done += count
+            self.bytes += nbytes
+            now = time.monotonic()
+            if now - self._last_emit < self._min_interval:
+                return
+            self._last_emit = now
+            snapshot = self._snapshot(now)
+            log_now = now - self._last_log >= self._log_interval
+            if log_now:
+                self._last_log = now
+        if log_now:
+            self.logger.info("%s: %s", self.name, snapshot.describe())
+        if self.callback:
+            self.callback(snapshot)
+
+    def start(self):
+        """Надсилає початковий знімок (0 з total)."""
+        if self.callback:
+            self.callback(self.snapshot())
+
+    def finish(self):
+        """Надсилає остаточний знімок незалежно від обмеження частоти."""
+        with self._lock:
+            if self.total and self.done > self.total:
+                self.total = self.done
+            snapshot = self._snapshot(time.monotonic())
+        self.logger.info("%s finished: %s", self.name, snapshot.describe())
+        if self.callback:
+            self.callback(snapshot)
+        return snapshot
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot(time.monotonic())
+
+    def _snapshot(self, now):
+        elapsed = max(now - self._start, 1e-9)
+        rate = (self.done - self._initial) / elapsed
+        mb_rate = self.bytes / elapsed / (1024 * 1024)
+        eta = None
+        if self.total and rate > 0 and self.done < self.total:
+            eta = (self.total - self.done) / rate
+        return Progress(self.done, self.total, self.bytes, elapsed, rate, mb_rate, eta)
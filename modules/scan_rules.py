@@ -0,0 +1,85 @@
+# modules/scan_rules.py
+
+import fnmatch
+import re
+
+# Правила за замовчуванням для кореня без власних налаштувань
+DEFAULT_SCAN_RULES = {
+    "include": [],
+    "exclude": ["~$*", "*.tmp", "Thumbs.db", "desktop.ini", ".DS_Store"],
+    "exclude_dirs": ["$RECYCLE.BIN", "System Volume Information", ".git"],
+}
+
+
+def _compile(patterns):
+    """
+    Об'єднує glob-шаблони в один регулярний вираз (без урахування регістру).
+    Повертає функцію-перевірку або None для порожнього списку.
+    """
+    patterns = [p for p in patterns if p]
+    if not patterns:
+        return None
+    regex = "|".join(f"(?:{fnmatch.translate(p)})" for p in patterns)
+    return re.compile(regex, re.IGNORECASE).match
+
+
+class ScanRules:
+    """
+    Скомпільовані правила включення/виключення для одного кореня.
+
+    Шаблони без "/" порівнюються з іменем файлу чи каталогу,
+    шаблони з "/" — з відносним шляхом від кореня (через "/").
+    Виключені каталоги відсікаються до читання, тож їхні піддерева
+    не скануються зовсім.
+    """
+    def __init__(self, rules=None):
+        rules = dict(DEFAULT_SCAN_RULES if rules is None else rules)
+        self.rules = rules
+        include = rules.get("include") or []
+        exclude = rules.get("exclude") or []
+        exclude_dirs = rules.get("exclude_dirs") or []
+        self._include = _compile(include)
+        self._exclude_name = _compile([p for p in exclude if "/" not in p])
+        self._exclude_path = _compile([p for p in exclude if "/" in p])
+        self._exclude_dir_name = _compile([p for p in exclude_dirs if "/" not in p])
+        self._exclude_dir_path = _compile([p.strip("/") for p in exclude_dirs if "/" in p])
+        # Чи потрібен відносний шлях для перевірки (інакше достатньо імені)
+        self.needs_path = bool(self._exclude_path or self._exclude_dir_path)
+
+    def allow_file(self, name, rel_path=None):
+        if self._exclude_name and self._exclude_name(name):
+            return False
+        if self._exclude_path and rel_path is not None \
+                and self._exclude_path(rel_path.replace("\\", "/")):
+            return False
+        if self._include and not self._include(name):
+            return False
+        return True
+
+    def allow_dir(self, name, rel_path=None):
+        if self._exclude_dir_name and self._exclude_dir_name(name):
+            return False
+        if self._exclude_dir_path and rel_path is not None \
+                and self._exclude_dir_path(rel_path.replace("\\", "/")):
+            return False
+        return True
+
+    def allow_dir_path(self, rel_path):
+        """Перевіряє відносний шлях каталогу разом з усіма батьківськими."""
+        if not rel_path:
+            return True
+        parts = rel_path.replace("\\", "/").split("/")
+        return all(self.allow_dir(part, "/".join(parts[:i + 1])) for i, part in enumerate(parts))
+
+    def allow_path(self, rel_path):
+        """Перевіряє відносний шлях файлу разом з усіма його каталогами."""
+        parts = rel_path.replace("\\", "/").split("/")
+        return (self.allow_dir_path("/".join(parts[:-1]))
+                and self.allow_file(parts[-1], "/".join(parts)))
+
+
+def compile_rules(rules=None):
+    """Повертає ScanRules; приймає словник правил, готовий ScanRules або None (типові)."""
+    if isinstance(rules, ScanRules):
+        return rules
+    return ScanRules(rules)
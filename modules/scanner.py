@@ -1,121 +1,506 @@
+import logging
 import os
-import sqlite3
-from config import DOCUMENTS_DIR, DB_PATH
-from .database import get_existing_filepaths, insert_documents_batch
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from config import DOCUMENTS_DIR
+from .database import (
+    insert_documents_batch, get_scan_state, save_scan_dirs, delete_scan_dirs,
+    get_max_document_id, get_documents_since, get_folder_documents,
+    mark_vanished, get_vanished, apply_reconciliation, delete_documents, get_root_documents,
+    get_scan_journal, start_scan_journal, update_scan_journal, clear_scan_journal, clear_scan_state
+)
+from .utils import compute_file_hash, compute_partial_hash, partial_fingerprint, hash_algorithm, PARTIAL_FINGERPRINT_PREFIX
+from .progress import ProgressReporter
+from .scan_rules import ScanRules, compile_rules
+
+logger = logging.getLogger(__name__)
+
+# Не допускає одночасного сканування з кількох потоків (UI, спостерігач)
+scan_lock = threading.RLock()
+
+# Корені, стан яких скинуто (reset_scan_state), але ще не проскановано заново
+_reset_roots = set()
+_reset_lock = threading.Lock()
 
 def batch_scan(folder_path: str, batch_size: int) -> None:
     """Scan folder_path and insert file metadata in batches."""
-    conn = sqlite3.connect(DB_PATH)
+    insert_new_files(folder_path, batch_size=batch_size, full_scan=True)
+
+def _read_dir(path: str, prev_mtime, full_scan: bool, prefetch_stat: bool,
+              base_dir: str, rules: ScanRules):
+    """
+    Читає один каталог. Повертає (mtime, files, subdirs), де files — DirEntry файлів,
+    або (mtime, None, None), якщо mtime не змінився і каталог можна не читати.
+    Файли та підкаталоги, виключені правилами rules, відкидаються одразу
+    (без stat і без читання піддерева).
+    При prefetch_stat stat файлів виконується тут же (у потоці пулу),
+    щоб мережеві звернення не блокували записувач.
+    """
+    mtime = os.stat(path).st_mtime
+    if not full_scan and prev_mtime is not None and prev_mtime == mtime:
+        return mtime, None, None
+
+    rel_dir = _rel_folder(path, base_dir) if rules.needs_path else None
+    files, subdirs = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            rel = os.path.join(rel_dir, entry.name) if rel_dir is not None else None
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if rules.allow_dir(entry.name, rel):
+                        subdirs.append(entry.path)
+                elif rules.allow_file(entry.name, rel):
+                    if prefetch_stat:
+                        entry.stat()
+                    files.append(entry)
+            except OSError:
+                continue
+    return mtime, files, subdirs
+
+
+def _iter_changed_dirs(base_dir: str, state: dict, full_scan: bool,
+                       dir_states: list, removed_dirs: list, workers: int = 1,
+                       resume_since: float = None, rules: ScanRules = None,
+                       start_dirs=None):
+    """
+    Обходить дерево base_dir через os.scandir і повертає (root, files) лише для
+    каталогів, mtime яких змінився з попереднього сканування (або всі при full_scan).
+    files — список DirEntry файлів каталогу.
+
+    Незмінені каталоги не читаються: їхні підкаталоги беруться зі
+    збереженого стану, тож для них виконується лише один stat.
+    Стан каталогу додається в dir_states після того, як споживач обробив
+    його файли; зниклі каталоги — в removed_dirs.
+
+    При workers > 1 каталоги читаються пулом потоків (до workers одночасних
+    звернень), а результати віддаються в порядку постановки в чергу,
+    тож споживач лишається єдиним упорядкованим записувачем.
+
+    resume_since — час початку перерваного сканування, яке продовжується:
+    каталоги, прочитані після цього моменту і відтоді не змінені,
+    не читаються повторно навіть при full_scan.
+
+    start_dirs — обійти лише піддерева цих каталогів (з тими ж правилами
+    пропуску незмінених), а не весь base_dir.
+    """
+    children = {}
+    for path, (parent, *_) in state.items():
+        if parent is not None:
+            children.setdefault(parent, []).append(path)
+
+    root_key = str(base_dir)
+    rules = compile_rules(rules)
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    # Черга ще не запущених каталогів і черга запущених (у порядку запуску)
+    if start_dirs:
+        todo = deque((path, state[path][0] if path in state else os.path.dirname(path))
+                     for path in start_dirs)
+    else:
+        todo = deque([(root_key, None)])
+    inflight = deque()
+    limit = max(1, workers) * 4
+
+    def start_pending():
+        while todo and len(inflight) < limit:
+            path, parent = todo.popleft()
+            prev = state.get(path)
+            fresh = (prev is not None and resume_since is not None
+                     and (prev[3] or 0) >= resume_since)
+            args = (path, prev[1] if prev else None, full_scan and not fresh,
+                    executor is not None, root_key, rules)
+            if executor is None:
+                inflight.append((path, parent, partial(_read_dir, *args)))
+            else:
+                inflight.append((path, parent, executor.submit(_read_dir, *args).result))
+
     try:
-        cur = conn.cursor()
-        batch = []
-        for root, _, files in os.walk(folder_path):
-            for name in files:
-                path = os.path.join(root, name)
-                try:
-                    st = os.stat(path)
-                except OSError:
-                    continue
-                rel = os.path.relpath(root, folder_path)
-                batch.append((name, path, '' if rel == '.' else rel, st.st_mtime, None))
-                if len(batch) >= batch_size:
-                    conn.execute("BEGIN")
-                    cur.executemany(
-                        "INSERT INTO documents (filename, filepath, folder, last_modified, file_hash, is_new) "
-                        "VALUES (?,?,?,?,?,1)",
-                        batch,
-                    )
-                    conn.commit()
-                    batch.clear()
-        if batch:
-            conn.execute("BEGIN")
-            cur.executemany(
-                "INSERT INTO documents (filename, filepath, folder, last_modified, file_hash, is_new) "
-                "VALUES (?,?,?,?,?,1)",
-                batch,
+        start_pending()
+        while inflight:
+            path, parent, result = inflight.popleft()
+            try:
+                mtime, files, subdirs = result()
+            except OSError as e:
+                logger.warning("Skipping unreadable directory: %s (%s)", path, e)
+                start_pending()
+                continue
+
+            if files is None:
+                todo.extend(
+                    (child, path) for child in children.get(path, [])
+                    if rules.allow_dir(os.path.basename(child), _rel_folder(child, root_key))
+                )
+                start_pending()
+                continue
+
+            logger.debug("Entering directory: %s", path)
+            todo.extend((sub, path) for sub in subdirs)
+            start_pending()
+
+            # Підкаталоги, які зникли з диска з минулого сканування
+            current = set(subdirs)
+            for old in children.get(path, []):
+                if old not in current:
+                    removed_dirs.append(old)
+                    removed_dirs.extend(_descendants(old, children))
+
+            yield path, files
+            dir_states.append(
+                (path, root_key, parent, mtime, len(files) + len(subdirs), time.time())
+            )
+            # Нові підкаталоги фіксуємо без mtime, щоб перерване сканування їх не втратило
+            dir_states.extend(
+                (sub, root_key, path, None, None, None) for sub in subdirs if sub not in state
             )
-            conn.commit()
     finally:
-        cur.close()
-        conn.close()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _descendants(path: str, children: dict) -> list:
+    result = []
+    stack = list(children.get(path, []))
+    while stack:
+        p = stack.pop()
+        result.append(p)
+        stack.extend(children.get(p, []))
+    return result
+
+
+def count_files(base_dir: str, rules=None) -> int:
+    """
+    Дешевий попередній підрахунок файлів під base_dir для прогресу.
+    Використовує лише os.scandir без stat, тож коштує одне читання каталогу.
+    Виключені правилами файли та каталоги не рахуються.
+    """
+    rules = compile_rules(rules)
+    base_dir = str(base_dir)
+    total = 0
+    stack = [base_dir]
+    while stack:
+        path = stack.pop()
+        rel_dir = _rel_folder(path, base_dir) if rules.needs_path else None
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    rel = os.path.join(rel_dir, entry.name) if rel_dir is not None else None
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if rules.allow_dir(entry.name, rel):
+                                stack.append(entry.path)
+                        elif rules.allow_file(entry.name, rel):
+                            total += 1
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+def _file_id(entry, st) -> int:
+    """
+    inode (file-id на Windows). DirEntry.stat() на Windows не заповнює st_ino,
+    тоді береться DirEntry.inode().
+    """
+    if st.st_ino:
+        return st.st_ino
+    try:
+        return entry.inode() or None
+    except OSError:
+        return None
+
+
+def _rel_folder(path: str, base_dir: str) -> str:
+    rel = os.path.relpath(path, base_dir)
+    return '' if rel == '.' else rel
+
+
+def _find_vanished(path: str, folder: str, names: set, rules: ScanRules = None) -> tuple:
+    """
+    Записи каталогу path, файлів яких немає серед names.
+    (folder неунікальний між коренями, тож шлях перевіряється додатково)
+    :return: (vanished, excluded) — id зниклих записів і id записів файлів,
+             які тепер виключені правилами rules (їх не узгоджують, а видаляють)
+    """
+    vanished, excluded = [], []
+    for doc_id, filepath in get_folder_documents(folder):
+        name = os.path.basename(filepath)
+        if os.path.dirname(filepath) != path or name in names:
+            continue
+        if rules is not None and not rules.allow_path(os.path.join(folder, name)):
+            excluded.append(doc_id)
+        else:
+            vanished.append(doc_id)
+    return vanished, excluded
+
+
+def prune_excluded(base_dir: str, rules=None) -> int:
+    """
+    Видаляє записи кореня base_dir, файли яких виключені правилами rules
+    (наприклад, Thumbs.db чи ~$*.docx, внесені до появи правила), одним батчем.
+    :return: кількість видалених записів
+    """
+    rules = compile_rules(rules)
+    excluded = [doc_id for doc_id, filepath in get_root_documents(base_dir)
+                if not rules.allow_path(os.path.relpath(filepath, base_dir))]
+    delete_documents(excluded)
+    if excluded:
+        logger.info("Removed %d excluded file(s) from %s", len(excluded), base_dir)
+    return len(excluded)
+
+
+def reconcile(base_dir: str, since_id: int) -> tuple:
+    """
+    Узгоджує зниклі файли з новими записами після сканування base_dir.
+
+    Зниклий запис зіставляється з новим (id > since_id) спершу за (size, mtime, inode),
+    потім за (size, mtime), потім за file_hash (хешуються лише нові файли
+    потрібного розміру).
+    Зіставлені записи переїжджають на новий шлях зі збереженням метаданих,
+    зв'язків і номерів; решта зниклих видаляються. Усе — однією транзакцією.
+
+    :return: (кількість переміщених, кількість видалених)
+    """
+    vanished = [row for row in get_vanished(base_dir) if not os.path.exists(row[2])]
+    if not vanished:
+        apply_reconciliation(base_dir, [], [])
+        return 0, 0
+
+    new_rows = get_documents_since(since_id)
+    by_stat, by_size = {}, {}
+    for new_id, filename, filepath, folder, last_mod, size, inode in new_rows:
+        by_stat.setdefault((size, last_mod), []).append((new_id, filename, inode))
+        by_size.setdefault(size, []).append((new_id, filepath))
+
+    moves, used, unmatched = [], set(), []
+    # 1) size + mtime (при кількох кандидатах перевага тому ж inode, потім імені файлу);
+    #    для старих записів без size — mtime разом з ім'ям файлу
+    for old_id, filename, filepath, last_mod, size, inode, file_hash in vanished:
+        if size is None:
+            candidates = [c for key, group in by_stat.items() if key[1] == last_mod
+                          for c in group if c[1] == filename and c[0] not in used]
+        else:
+            candidates = [c for c in by_stat.get((size, last_mod), []) if c[0] not in used]
+        if last_mod is not None and candidates:
+            same_inode = [c for c in candidates if inode and c[2] == inode]
+            same_name = [c for c in candidates if c[1] == filename]
+            new_id = (same_inode or same_name or candidates)[0][0]
+            used.add(new_id)
+            moves.append((old_id, new_id))
+        else:
+            unmatched.append((old_id, size, file_hash))
+
+    # 2) file_hash: повний хеш або частковий відбиток "part:" (відбиток "size:" надто слабкий)
+    new_hashes = {}
+    deleted = []
+    for old_id, size, file_hash in unmatched:
+        match = None
+        partial = bool(file_hash) and file_hash.startswith(PARTIAL_FINGERPRINT_PREFIX)
+        algorithm = hash_algorithm(file_hash)
+        if algorithm or partial:
+            for new_id, new_path in by_size.get(size, []):
+                if new_id in used:
+                    continue
+                key = (new_id, algorithm)
+                if key not in new_hashes:
+                    try:
+                        if partial:
+                            new_hashes[key] = partial_fingerprint(size, compute_partial_hash(new_path, size))
+                        else:
+                            # тим самим алгоритмом, що й збережений хеш
+                            new_hashes[key] = compute_file_hash(new_path, algorithm=algorithm)
+                    except OSError:
+                        new_hashes[key] = None
+                if new_hashes[key] == file_hash:
+                    match = new_id
+                    break
+        if match is None:
+            deleted.append(old_id)
+        else:
+            used.add(match)
+            moves.append((old_id, match))
+
+    apply_reconciliation(base_dir, moves, deleted)
+    logger.info("Reconciled: %d moved, %d deleted", len(moves), len(deleted))
+    return len(moves), len(deleted)
+
 
 def insert_new_files(base_dir: str = None,
                      progress_callback=None,
                      batch_size: int = 500,
-                     throttle: int = 1):
+                     progress_rate: float = 4.0,
+                     full_scan: bool = False,
+                     precount: bool = False,
+                     workers: int = 1,
+                     rules=None,
+                     dirs=None):
     """
-    Швидке сканування директорії base_dir з використанням os.walk та батчеві вставки без обчислення хешу.
+    Потокове сканування директорії base_dir через os.scandir і батчеві вставки без обчислення хешу.
+
+    Файли не збираються в список: записи формуються з DirEntry (один stat на файл)
+    і одразу пишуться в БД батчами через upsert, тож нові файли визначає сама БД.
+    Зберігає стан кожного каталогу (mtime, кількість записів) у scan_dirs і при
+    повторному скануванні читає лише каталоги, mtime яких змінився.
+    Записи файлів, що зникли з прочитаних каталогів, позначаються і після
+    сканування узгоджуються з новими записами (див. reconcile).
+    Хід сканування записується в scan_journal: перерване сканування
+    (закриття програми, відключення диска) продовжується з місця зупинки.
 
     :param base_dir: коренева директорія для сканування (за замовчуванням DOCUMENTS_DIR)
-    :param progress_callback: функція progress_callback(done, total)
+    :param progress_callback: функція progress_callback(Progress); total=0, якщо невідомо
     :param batch_size: розмір батчу для вставки в БД
-    :param throttle: інтервал оновлення прогресу
+    :param progress_rate: максимальна кількість оновлень прогресу за секунду
+    :param full_scan: ігнорувати збережений стан і пройти всі каталоги
+    :param precount: попередньо порахувати файли для визначеного прогресу
+    :param workers: кількість потоків для паралельного читання каталогів
+                    (для мережевих дисків з високою затримкою)
+    :param rules: правила включення/виключення (dict або ScanRules; None — типові)
+    :param dirs: каталоги під base_dir, піддерева яких треба пройти (події
+                 спостерігача); None — увесь корінь. Без збереженого стану кореня
+                 або при перерваному скануванні проходиться весь корінь.
+    :return: кількість змінених записів (вставлених, оновлених, переміщених, видалених)
     """
     if base_dir is None:
         base_dir = DOCUMENTS_DIR
 
-    print(f"[scan] Starting new file scan in: {base_dir}")
+    with scan_lock:
+        with _reset_lock:
+            reset = str(base_dir) in _reset_roots
+            _reset_roots.discard(str(base_dir))
+        if reset:
+            # Сканування, що йшло під час reset_scan_state, могло знову записати стан
+            clear_scan_state(base_dir)
+        return _scan(base_dir, progress_callback, batch_size, progress_rate,
+                     full_scan, precount, workers, compile_rules(rules), dirs)
 
-    # Існуючі шляхи в БД
-    existing_paths = set(get_existing_filepaths())
-    print(f"[scan] Retrieved {len(existing_paths)} existing file paths from DB")
 
-    # Збираємо список усіх файлів для сканування
-    all_files = []
-    for root, _, files in os.walk(base_dir):
-        print(f"[scan] Entering directory: {root}")
-        for f in files:
-            all_files.append(os.path.join(root, f))
-    total = len(all_files)
-    print(f"[scan] Found {total} files to scan")
+def reset_scan_state(base_dir: str) -> None:
+    """
+    Скидає стан сканування кореня base_dir (змінені правила), не чекаючи на
+    сканування, що вже виконується: наступне сканування кореня пройде всі
+    каталоги і прибере записи виключених файлів (див. prune_excluded).
+    """
+    with _reset_lock:
+        _reset_roots.add(str(base_dir))
+    clear_scan_state(base_dir)
 
-    # Початкове оновлення прогресу: 0 файлів із total
-    if progress_callback:
-        print(f"[scan] Progress: 0/{total}")
-        progress_callback(0, total)
 
-    done = 0
-    new_records = []
+def _scan(base_dir, progress_callback, batch_size, progress_rate, full_scan, precount, workers,
+          rules, dirs=None):
+    journal = get_scan_journal(base_dir)
+    state = get_scan_state(base_dir)
+    if journal is not None or not state:
+        # Перерване сканування продовжується, а перше — проходить увесь корінь
+        dirs = None
+    if journal is not None:
+        # Продовжуємо перерване сканування: каталоги, стан яких уже збережено,
+        # не читаються повторно, а їхні файли вже враховано в done
+        resume_since, journal_full, since_id, done = journal
+        full_scan = full_scan or bool(journal_full)
+        logger.info("Resuming scan of %s (%d files done)", base_dir, done)
+    else:
+        resume_since, since_id, done = None, get_max_document_id(), 0
+        start_scan_journal(base_dir, time.time(), full_scan, since_id)
 
-    for full_path in all_files:
-        done += 1
+    logger.info("Starting new file scan in: %s (full_scan=%s, workers=%d, dirs=%s)",
+                base_dir, full_scan, workers, len(dirs) if dirs else "all")
 
-        # Періодичне оновлення прогресу
-        if progress_callback and done % throttle == 0:
-            print(f"[scan] Progress: {done}/{total}")
-            progress_callback(done, total)
+    changed = 0
+    if not state and journal is None:
+        # Стану кореня немає (перше сканування або змінені правила, див.
+        # reset_scan_state): записи у виключених каталогах уже не будуть
+        # прочитані, тож прибираємо їх тут
+        changed += prune_excluded(base_dir, rules)
+    dir_states = []
+    removed_dirs = []
+    vanished = []
+    excluded = []
 
-        # Пропускаємо вже наявні
-        if full_path in existing_paths:
-            continue
+    total = count_files(base_dir, rules) if precount else 0
+    if precount:
+        logger.info("Pre-counted %d files", total)
 
-        # Пробуємо отримати дату модифікації
-        try:
-            last_mod = os.path.getmtime(full_path)
-        except OSError as e:
-            print(f"[scan] Skipping unreadable file: {full_path} ({e})")
-            continue
+    # Початкове оновлення прогресу
+    progress = ProgressReporter(progress_callback, total, max_rate=progress_rate,
+                                name="scan", logger=logger, done=done)
+    progress.start()
 
-        rel_folder = os.path.relpath(os.path.dirname(full_path), base_dir)
-        if rel_folder == '.':
-            rel_folder = ''
-        filename = os.path.basename(full_path)
-        new_records.append((filename, full_path, rel_folder, last_mod, None))
+    # Кількість файлів прочитаних каталогів, стан яких ще не збережено
+    dir_files = {}
 
-        # Батчевий запис у БД
-        if len(new_records) >= batch_size:
-            print(f"[scan] Inserting batch of {len(new_records)} records into DB")
-            insert_documents_batch(new_records)
+    def flush():
+        nonlocal changed, done
+        # Стан каталогів пишемо разом із їхніми файлами
+        if new_records:
+            logger.debug("Inserting batch of %d records into DB", len(new_records))
+            changed += insert_documents_batch(new_records)
             new_records.clear()
+        if removed_dirs:
+            for path in removed_dirs:
+                gone, skip = _find_vanished(path, _rel_folder(path, base_dir), set(), rules)
+                vanished.extend(gone)
+                excluded.extend(skip)
+            delete_scan_dirs(removed_dirs)
+            removed_dirs.clear()
+        if vanished:
+            mark_vanished(vanished, base_dir)
+            vanished.clear()
+        if excluded:
+            # Файли, виключені правилами (зокрема після їх зміни), з реєстру прибираються
+            delete_documents(excluded)
+            changed += len(excluded)
+            excluded.clear()
+        if dir_states:
+            save_scan_dirs(dir_states)
+            # У журнал потрапляють лише файли каталогів зі збереженим станом:
+            # каталог, перерваний посередині, після продовження читається знову
+            done += sum(dir_files.pop(st[0], 0) for st in dir_states if st[3] is not None)
+            dir_states.clear()
+        update_scan_journal(base_dir, done)
 
-    # Вставляємо залишки
-    if new_records:
-        print(f"[scan] Inserting final batch of {len(new_records)} records into DB")
-        insert_documents_batch(new_records)
+    new_records = []
+    changed_dirs = _iter_changed_dirs(base_dir, state, full_scan, dir_states, removed_dirs,
+                                      workers, resume_since, rules, dirs)
 
-    # Остаточне оновлення прогресу
-    if progress_callback:
-        print(f"[scan] Progress: {done}/{total} (complete)")
-        progress_callback(done, total)
+    for root, files in changed_dirs:
+        rel_folder = _rel_folder(root, base_dir)
+        dir_files[root] = len(files)
+        for entry in files:
+            try:
+                st = entry.stat()
+            except OSError as e:
+                logger.warning("Skipping unreadable file: %s (%s)", entry.path, e)
+                progress.advance()
+                continue
+
+            # Оновлення прогресу (обмежене за частотою)
+            progress.advance(1, st.st_size)
+
+            new_records.append((entry.name, entry.path, rel_folder, st.st_mtime, None,
+                                st.st_size, _file_id(entry, st), st.st_ctime))
+
+            # Батчевий запис у БД
+            if len(new_records) >= batch_size:
+                flush()
 
-    print(f"[scan] Scan complete. Processed {done} files")
+        # Файли каталогу, яких більше немає на диску
+        gone, skip = _find_vanished(root, rel_folder, {e.name for e in files}, rules)
+        vanished.extend(gone)
+        excluded.extend(skip)
+        if len(dir_states) >= batch_size or len(vanished) + len(excluded) >= batch_size:
+            flush()
+
+    # Записуємо залишки
+    flush()
+
+    # Узгодження переміщених/видалених файлів
+    moved, deleted = reconcile(base_dir, since_id)
+    changed += moved + deleted
+    clear_scan_journal(base_dir)
+
+    # Остаточне оновлення прогресу
+    progress.finish()
+    logger.info("Scan complete. Processed %d files", done)
+    return changed
@@ -3,6 +3,9 @@
 import json
 from pathlib import Path
 from config import PROJECT_ROOT
+from .scan_rules import DEFAULT_SCAN_RULES
+from .hashing import HASH_ENGINES
+from .utils import HASH_ALGORITHMS, DEFAULT_HASH_ALGORITHM
 
 SETTINGS_FILE = PROJECT_ROOT / "config" / "settings.json"
 
@@ -39,6 +42,7 @@ class SettingsManager:
     def remove_folder(self, path):
         if path in self._data["folders"]:
             self._data["folders"].remove(path)
+            self._data.get("rules", {}).pop(path, None)
             if self._data["active"] == path:
                 self._data["active"] = self._data["folders"][0] if self._data["folders"] else None
             self.save()
@@ -50,3 +54,64 @@ class SettingsManager:
         if path in self._data["folders"]:
             self._data["active"] = path
             self.save()
+
+    def get_scan_workers(self):
+        # Кількість потоків читання каталогів (>1 для мережевих дисків)
+        return max(1, int(self._data.get("scan_workers", 1)))
+
+    def set_scan_workers(self, count):
+        self._data["scan_workers"] = max(1, int(count))
+        self.save()
+
+    def get_watch_enabled(self):
+        # Фонове стеження за змінами в каталогах замість повторних сканувань
+        return bool(self._data.get("watch", False))
+
+    def set_watch_enabled(self, enabled):
+        self._data["watch"] = bool(enabled)
+        self.save()
+
+    def get_hash_workers(self):
+        # Кількість процесів (потоків) фонового хешування
+        return max(1, int(self._data.get("hash_workers", 2)))
+
+    def set_hash_workers(self, count):
+        self._data["hash_workers"] = max(1, int(count))
+        self.save()
+
+    def get_hash_budget(self):
+        # Ліміт читання фонового хешування, МБ/с (0 — без обмеження)
+        return max(0, int(self._data.get("hash_budget", 0)))
+
+    def set_hash_budget(self, mb_per_sec):
+        self._data["hash_budget"] = max(0, int(mb_per_sec))
+        self.save()
+
+    def get_hash_engine(self):
+        # Пул для повного хешування: 'process' (обходить GIL) або 'thread'
+        engine = self._data.get("hash_engine", "process")
+        return engine if engine in HASH_ENGINES else "process"
+
+    def set_hash_engine(self, engine):
+        if engine in HASH_ENGINES:
+            self._data["hash_engine"] = engine
+            self.save()
+
+    def get_hash_algorithm(self):
+        # Алгоритм повного хешу нових файлів (наявні хеші залишаються порівнюваними)
+        algorithm = self._data.get("hash_algorithm", DEFAULT_HASH_ALGORITHM)
+        return algorithm if algorithm in HASH_ALGORITHMS else DEFAULT_HASH_ALGORITHM
+
+    def set_hash_algorithm(self, algorithm):
+        if algorithm in HASH_ALGORITHMS:
+            self._data["hash_algorithm"] = algorithm
+            self.save()
+
+    def get_rules(self, path):
+        # Правила включення/виключення файлів і каталогів для кореня path
+        rules = self._data.get("rules", {}).get(path)
+        return {k: list(v) for k, v in (rules or DEFAULT_SCAN_RULES).items()}
+
+    def set_rules(self, path, rules):
+        self._data.setdefault("rules", {})[path] = rules
+        self.save()
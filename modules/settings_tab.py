@@ -3,7 +3,8 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
 from .settings import SettingsManager
-from .database import db
+from .database import db, clear_scan_state
+from .scanner import reset_scan_state
 
 class SettingsTab(tk.Frame):
     def __init__(self, parent, app):
@@ -23,7 +24,12 @@ class SettingsTab(tk.Frame):
         tk.Button(btns, text="Видалити", command=self._remove).pack(side=tk.LEFT, padx=5)
         tk.Button(btns, text="Встановити активним", command=self._set_active).pack(side=tk.LEFT, padx=5)
         tk.Button(btns, text="Повторно сканувати", command=self._rescan).pack(side=tk.LEFT, padx=5)
+        tk.Button(btns, text="Правила сканування", command=self._edit_rules).pack(side=tk.LEFT, padx=5)
         tk.Button(btns, text="Видалити всі значення", command=self._clear_all).pack(side=tk.LEFT, padx=5)
+        tk.Button(btns, text="Хешування", command=self._edit_hashing).pack(side=tk.LEFT, padx=5)
+        self.watch_var = tk.BooleanVar(value=self.sm.get_watch_enabled())
+        tk.Checkbutton(btns, text="Стежити за змінами", variable=self.watch_var,
+                       command=self._toggle_watch).pack(side=tk.LEFT, padx=5)
 
         self._populate()
 
@@ -41,6 +47,7 @@ class SettingsTab(tk.Frame):
         if not self.sm.add_folder(path):
             messagebox.showinfo("Увага", "Цей каталог вже додано.")
         self._populate()
+        self.app.restart_watcher()
 
     def _remove(self):
         sel = self.tree.selection()
@@ -51,6 +58,7 @@ class SettingsTab(tk.Frame):
         if messagebox.askyesno("Підтвердження", f"Видалити каталог?\n{path}"):
             self.sm.remove_folder(path)
             self._populate()
+            self.app.restart_watcher()
 
     def _set_active(self):
         sel = self.tree.selection()
@@ -64,11 +72,68 @@ class SettingsTab(tk.Frame):
         self.app.current_scan_folder = path
         self.app.load_registry_data()
 
+    def _edit_rules(self):
+        sel = self.tree.selection()
+        if not sel:
+            return
+        path = self.sm.get_folders()[int(sel[0])]
+        rules = self.sm.get_rules(path)
+        prompts = [
+            ("exclude", "Виключити файли (шаблони через кому):"),
+            ("exclude_dirs", "Виключити каталоги (імена або шаблони через кому):"),
+            ("include", "Включати лише файли (шаблони через кому, порожньо — усі):"),
+        ]
+        for key, prompt in prompts:
+            ans = simpledialog.askstring("Правила сканування", prompt,
+                                         initialvalue=", ".join(rules.get(key, [])))
+            if ans is None:
+                return
+            rules[key] = [p.strip() for p in ans.split(",") if p.strip()]
+        self.sm.set_rules(path, rules)
+        # Змінені правила потребують повного проходу кореня;
+        # записи виключених файлів прибере це сканування (якщо сканування
+        # вже йде — після нього, див. start_scan)
+        reset_scan_state(path)
+        self.app.restart_watcher()
+        if path == self.app.current_scan_folder:
+            self.app.start_scan()
+
+    def _edit_hashing(self):
+        workers = simpledialog.askinteger(
+            "Хешування", "Кількість процесів хешування:",
+            initialvalue=self.sm.get_hash_workers(), minvalue=1, maxvalue=32
+        )
+        if workers is None:
+            return
+        budget = simpledialog.askinteger(
+            "Хешування", "Ліміт читання, МБ/с (0 — без обмеження):",
+            initialvalue=self.sm.get_hash_budget(), minvalue=0
+        )
+        if budget is None:
+            return
+        self.sm.set_hash_workers(workers)
+        self.sm.set_hash_budget(budget)
+        self.app.configure_hashing(workers, budget)
+
+    def _toggle_watch(self):
+        enabled = self.watch_var.get()
+        self.sm.set_watch_enabled(enabled)
+        self.app.watch_enabled = enabled
+        if enabled:
+            self.app.start_watcher()
+        else:
+            self.app.stop_watcher()
+
     def _rescan(self):
-        # Ручний запуск сканування
-        self.app._scan_and_update()
-        self.app.load_registry_data()
-        messagebox.showinfo("Готово", "Сканування завершено.")
+        # Ручний запуск повного сканування (без пропуску незмінених каталогів)
+        # у фоновому потоці; дерево оновить _finish_scan
+        started = self.app.start_scan(
+            full_scan=True,
+            on_done=lambda: messagebox.showinfo("Готово", "Сканування завершено.")
+        )
+        if not started:
+            messagebox.showinfo("Увага", "Сканування вже виконується; повне сканування "
+                                         "почнеться після нього.")
 
     def _clear_all(self):
         # Підрахунок записів
@@ -88,5 +153,6 @@ class SettingsTab(tk.Frame):
         db.execute("DELETE FROM document_numbers")
         db.execute("DELETE FROM document_links")
         db.execute("DELETE FROM documents")
+        clear_scan_state()
         messagebox.showinfo("Готово", f"Видалено інформацію про {count} записів.")
         self.app.load_registry_data()
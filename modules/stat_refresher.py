@@ -0,0 +1,125 @@
+"""
+Фонова перевірка stat файлів реєстру.
+
+Дерево показує «Змінено» зі збереженого last_modified і не звертається до
+диска. StatRefresher у окремому потоці невеликими пачками проходить записи,
+оновлює last_modified / size / inode / ctime і позначку is_missing та
+повідомляє лише про змінені записи, щоб UI оновив відповідні клітинки.
+"""
+import logging
+import os
+import threading
+import time
+
+from modules.database import get_file_stats, save_file_stats
+
+logger = logging.getLogger(__name__)
+
+
+class StatRefresher:
+    """
+    Низькопріоритетна задача оновлення stat-полів.
+
+    Прохід читає записи пачками по batch_size і між пачками робить паузу
+    delay секунд; протягом idle_delay секунд після touch() (дії користувача)
+    нова пачка не починається. Перед кожним проходом (зокрема першим — записи
+    щойно оновило сканування) потік чекає на wake() або interval секунд.
+    on_change(changes) викликається з фонового потоку для кожної пачки,
+    де щось змінилось: changes — list of tuples (id, last_modified, is_missing).
+    """
+    def __init__(self, on_change=None, batch_size=200, delay=0.2,
+                 idle_delay=1.5, interval=300.0):
+        self.on_change = on_change
+        self.batch_size = batch_size
+        self.delay = delay
+        self.idle_delay = idle_delay
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._wake = False
+        self._last_activity = 0.0
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="stat-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wake(self):
+        """Запускає новий прохід, не чекаючи interval."""
+        with self._cond:
+            self._wake = True
+            self._cond.notify_all()
+
+    def touch(self):
+        """Позначає активність користувача: перевірка відступає на idle_delay секунд."""
+        self._last_activity = time.monotonic()
+
+    def _wait_turn(self):
+        # False, якщо задачу зупинено
+        with self._cond:
+            self._cond.wait_for(lambda: self._stopped, self.delay)
+            while not self._stopped:
+                idle = time.monotonic() - self._last_activity
+                if idle >= self.idle_delay:
+                    break
+                self._cond.wait(self.idle_delay - idle)
+            return not self._stopped
+
+    def refresh(self):
+        """
+        Один прохід по всіх записах.
+        :return: кількість записів зі зміненими stat-полями або позначкою
+        """
+        total = 0
+        after_id = 0
+        while self._wait_turn():
+            rows = get_file_stats(after_id, self.batch_size)
+            if not rows:
+                break
+            after_id = rows[-1][0]
+            changed, missing, changes = [], [], []
+            for doc_id, path, last_mod, size, inode, is_missing in rows:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    if not is_missing:
+                        missing.append(doc_id)
+                        changes.append((doc_id, last_mod, 1))
+                    continue
+                ino = st.st_ino or None
+                if (is_missing or st.st_mtime != last_mod or st.st_size != size
+                        or (inode is not None and ino != inode)):
+                    changed.append({'id': doc_id, 'mtime': st.st_mtime, 'size': st.st_size,
+                                    'inode': ino, 'ctime': st.st_ctime})
+                    changes.append((doc_id, st.st_mtime, 0))
+            if not changes:
+                continue
+            save_file_stats(changed, missing)
+            total += len(changes)
+            if self.on_change:
+                self.on_change(changes)
+        return total
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._wake and not self._stopped:
+                    self._cond.wait(self.interval)
+                self._wake = False
+                if self._stopped:
+                    break
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Stat refresh failed")
@@ -1,10 +1,11 @@
 # modules/tree_setup.py
 
+import json
 import os
 import re
-import sqlite3
 from datetime import datetime
-from config import DB_PATH
+from .database import (db, fts_query, normalize_term, search_index_ready, search_match_sql,
+                       FTS_MIN_TERM)
 
 # Ширини колонок за замовчуванням
 default_widths = {
@@ -50,90 +51,136 @@ def setup_tree_widget(self):
         else:
             self.tree.column(col, width=140, anchor="w", stretch=True)
 
+    # Вміст папок ієрархічного дерева вставляється при розкритті
+    self.tree.bind("<<TreeviewOpen>>", lambda e: expand_folder(self, self.tree.focus()))
 
-def load_documents_into_tree(self, hierarchical=True):
+
+# Поля, порожнє значення яких робить запис «недопрацьованим»
+_REQUIRED_FIELDS = ('doc_type', 'doc_number', 'doc_date', 'sender', 'description')
+
+
+def _contains(expr):
+    # instr замість LIKE: у пошуковому рядку '%' і '_' — звичайні символи
+    return f"instr(ulower({expr}), ?) > 0"
+
+
+def build_filter_sql(self):
     """
-    Завантажити документи в дерево.
-    Якщо hierarchical=True, групувати за папками (folder).
-    Інакше — плоский список.
-    """
-    # 1) Зберегти стан відкритих вузлів
-    open_nodes = set()
-    def collect(n):
-        if self.tree.item(n, "open"):
-            open_nodes.add(n)
-        for c in self.tree.get_children(n):
-            collect(c)
-    for rid in self.tree.get_children(""):
-        collect(rid)
-
-    # 2) Очистка treeview
-    for iid in self.tree.get_children(""):
-        self.tree.delete(iid)
-
-    # 3) Зчитати дані
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, filename, doc_date, doc_type, doc_number,
-               sender, status, tags, is_controlled, deadline,
-               description, filepath, folder
-          FROM documents
-    """)
-    docs = cur.fetchall()
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_num_value ON document_numbers(number_value)")
-    cur.execute("SELECT document_id, number_value FROM document_numbers")
-    nums = {}
-    for did, val in cur.fetchall():
-        nums.setdefault(did, []).append(val.lower())
-    conn.close()
-
-    # 4) Фільтрація
-    term = getattr(self, 'search_term', '').lower()
-    show_inc = getattr(self, 'show_incomplete', False)
-    dir_f = (getattr(self, 'filter_direction', '') or '').lower()
-    type_f = (getattr(self, 'filter_type', '') or '').lower()
-    tags_f = (getattr(self, 'filter_tags', '') or '').lower()
+    Перетворити стан фільтрів (apply_filters / show_new_files) на умову WHERE
+    для documents d.
+    :return: tuple (where, params); where — порожній рядок, якщо фільтрів немає
+    """
+    clauses, params = [], []
+
+    term = normalize_term(getattr(self, 'search_term', ''))
+    if len(term) >= FTS_MIN_TERM and search_index_ready():
+        clauses.append("d.id IN (SELECT rowid FROM documents_fts WHERE documents_fts MATCH ?)")
+        params.append(fts_query(term))
+    elif term:
+        # Для 1–2 символів триграмного індексу немає (або SQLite без FTS5) — повний перегляд
+        clauses.append(search_match_sql('d'))
+        params += [term, term]
+    if getattr(self, 'show_incomplete', False):
+        clauses.append('(' + ' OR '.join(f"COALESCE(d.{f}, '') = ''" for f in _REQUIRED_FIELDS) + ')')
+    direction = (getattr(self, 'filter_direction', '') or '').lower()
+    if direction:
+        clauses.append("ulower(d.status) = ?")
+        params.append(direction)
+    for attr, col in (('filter_type', 'd.doc_type'), ('filter_tags', 'd.tags'),
+                      ('filter_num_main', 'd.doc_number')):
+        value = (getattr(self, attr, '') or '').lower()
+        if value:
+            clauses.append(_contains(col))
+            params.append(value)
     date_from = getattr(self, 'filter_date_from', '')
+    if date_from:
+        clauses.append("d.doc_date >= ?")
+        params.append(date_from)
     date_to = getattr(self, 'filter_date_to', '')
-    num_main_f = getattr(self, 'filter_num_main', '').lower()
-    num_extra_f = getattr(self, 'filter_num_extra', '').lower()
+    if date_to:
+        clauses.append("d.doc_date > '' AND d.doc_date <= ?")
+        params.append(date_to)
+    num_extra = (getattr(self, 'filter_num_extra', '') or '').lower()
+    if num_extra:
+        clauses.append(
+            "EXISTS (SELECT 1 FROM document_numbers n WHERE n.document_id = d.id AND "
+            f"{_contains('n.number_value')})"
+        )
+        params.append(num_extra)
+    new_ids = getattr(self, 'filter_new', None)
+    if new_ids:
+        clauses.append("d.id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(new_ids)))
+    dup_only = getattr(self, 'show_duplicates', None)
+    if dup_only is not None and dup_only.get():
+        clauses.append(
+            "d.file_hash IN (SELECT g.file_hash FROM duplicate_groups g WHERE g.member_count > 1)"
+        )
+
+    if not clauses:
+        return '', ()
+    return 'WHERE ' + '\n   AND '.join(clauses), tuple(params)
+
+
+ROOT_IID = '__ROOT__'
+_FOLDER_PREFIX = 'folder::'
+_PLACEHOLDER = '::placeholder'
+# Рядок «ще N записів» у кінці плоского списку
+MORE_IID = '__MORE__'
+# Скільки записів плоского списку вставляється за раз
+FLAT_PAGE_SIZE = 500
+
+
+def natural_key(s):
+    return [int(tok) if tok.isdigit() else tok.lower()
+            for tok in re.split(r'(\d+)', s)]
+
+
+def _folder_iid(folder):
+    return f"{_FOLDER_PREFIX}{folder}" if folder else ROOT_IID
+
+
+def _iid_folder(iid):
+    return '' if iid == ROOT_IID else iid[len(_FOLDER_PREFIX):]
+
 
-    rows = []  # will hold tuples (did, name, values, ctrl, folder)
-    for did, name, date, typ, num, sender, status, tags, ctrl, deadline, desc, path, folder in docs:
+def _query_rows(self, extra_clause='', extra_params=()):
+    """
+    Відфільтровані записи (build_filter_sql + extra_clause):
+    list of tuples (did, name, values, ctrl, folder, missing)
+    """
+    where, params = build_filter_sql(self)
+    if extra_clause:
+        where = f"{where}\n   AND {extra_clause}" if where else f"WHERE {extra_clause}"
+        params = (*params, *extra_params)
+    # Режим «Дублікати»: канонічний запис групи (для сортування)
+    canonical = ("(SELECT g.canonical_id FROM duplicate_groups g WHERE g.file_hash = d.file_hash)"
+                 if self._tree_state['dup_only'] else "NULL")
+    rows = db.query(f"""
+        SELECT d.id, d.filename, d.doc_date, d.doc_type, d.doc_number,
+               d.sender, d.status, d.tags, d.is_controlled, d.deadline,
+               d.description, d.last_modified, d.is_missing, d.folder, {canonical}
+          FROM documents d
+         {where}
+    """, params)
+    result = []
+    for did, name, date, typ, num, sender, status, tags, ctrl, deadline, desc, mtime, missing, folder, canon in rows:
         vals = [
             status or '', typ or '', num or '', date or '',
             sender or '', tags or '', '✅' if ctrl else '',
             deadline or '', desc or '',
-            datetime.fromtimestamp(os.path.getmtime(path)).strftime('%d-%m-%Y %H:%M')
-            if os.path.exists(path) else ''
+            format_modified(mtime, missing)
         ]
-        base, _ = os.path.splitext(name)
-        flat = f"{folder} {base.lower()} " + ' '.join(v.lower() for v in vals)
-        extra = nums.get(did, [])
-        if extra:
-            flat += ' ' + ' '.join(extra)
-        # пошук + фільтри
-        if term and term not in flat: continue
-        inc = not all((vals[1], vals[2], vals[3], vals[4], vals[8]))
-        if show_inc and not inc: continue
-        if dir_f and status.lower() != dir_f: continue
-        if type_f and type_f not in typ.lower(): continue
-        if tags_f and tags_f not in tags.lower(): continue
-        if date_from and (not date or date < date_from): continue
-        if date_to and (not date or date > date_to): continue
-        if num_main_f and num_main_f not in num.lower(): continue
-        if num_extra_f and all(num_extra_f not in ex for ex in extra): continue
-        rows.append((did, name, vals, ctrl, folder))
-
-    # 5) Сортування рядків
-    def natural_key(s):
-        return [int(tok) if tok.isdigit() else tok.lower()
-                for tok in re.split(r'(\d+)', s)]
+        self._tree_state['canonical'][did] = canon
+        result.append((did, name, vals, ctrl, folder, missing))
+    return result
+
 
+def _sort_rows(self, rows, by_name=False):
+    """Сортування за вибраною колонкою; інакше дублікати групами або (by_name) за назвою."""
     if self.sort_by_col:
         def sort_key(item):
-            did, name, vals, ctrl, folder = item
+            did, name, vals, ctrl, folder, missing = item
             col = self.sort_by_col
             if col == 'filename':
                 return natural_key(name)
@@ -153,39 +200,274 @@ def load_documents_into_tree(self, hierarchical=True):
                 except: return datetime.min
             return v.lower()
         rows.sort(key=sort_key, reverse=self.sort_reverse)
+    elif self._tree_state['dup_only']:
+        # Дублікати одного вмісту — поруч, канонічний запис першим
+        canonical = self._tree_state['canonical']
+        rows.sort(key=lambda r: (canonical[r[0]], r[0] != canonical[r[0]], natural_key(r[1])))
+    elif by_name:
+        rows.sort(key=lambda r: natural_key(r[1]))
+    return rows
+
+
+def _row_entries(rows):
+    # Елементи дерева: (iid, text, values, tags)
+    return [(str(did), name, tuple(vals), row_tags(ctrl, missing))
+            for did, name, vals, ctrl, folder, missing in rows]
+
+
+def _folder_rows(self, folders):
+    """
+    Записи папок folders одним запитом (по idx_documents_folder):
+    dict {folder: rows}; записи кореня — під ключем ''.
+    """
+    if not folders:
+        return {}
+    clause = "d.folder IN (SELECT value FROM json_each(?))"
+    if '' in folders:
+        clause = f"({clause} OR d.folder IS NULL)"
+    by_folder = {folder: [] for folder in folders}
+    for row in _query_rows(self, clause, (json.dumps(sorted(folders)),)):
+        by_folder.setdefault(row[4] or '', []).append(row)
+    return by_folder
 
-    # 6) Створити структуру папок + документів
-    tree_map = {'subfolders': {}, 'docs': []}
-    for did, name, vals, ctrl, folder in rows:
-        node = tree_map
-        for part in folder.split(os.sep) if folder else []:
-            node = node['subfolders'].setdefault(part, {'subfolders':{}, 'docs':[]})
-        node['docs'].append((did,name,vals,ctrl))
-
-    # 7) Рекурсивна вставка з сортуванням папок та файлів
-    root_id = '__ROOT__'
-    self.tree.insert('', 'end', iid=root_id, text='📁 [Корінь]', open=False)
-    def insert_node(node, parent):
-        # папки
-        for fname, subtree in sorted(node['subfolders'].items(), key=lambda x: natural_key(x[0])):
-            prefix = os.path.join(parent, fname) if parent!='' else fname
-            nid = f"folder::{prefix}"
-            self.tree.insert(parent, 'end', iid=nid, text=fname, open=False)
-            insert_node(subtree, nid)
-        # файли
-        for did, name, vals, ctrl in sorted(node['docs'], key=lambda x: natural_key(x[1])):
-            tag = 'controlled' if ctrl else ''
-            self.tree.insert(parent, 'end', iid=str(did), text=name, values=vals, tags=(tag,))
-    if hierarchical:
-        insert_node(tree_map, root_id)
+
+def _folder_entries(self, folder, rows):
+    """Вміст папки folder: підпапки (у natural-порядку), потім документи rows."""
+    entries = []
+    for name in sorted(self._tree_state['subfolders'].get(folder, ()), key=natural_key):
+        path = os.path.join(folder, name) if folder else name
+        entries.append((_folder_iid(path), name, (), ()))
+    return entries + _row_entries(_sort_rows(self, rows, by_name=True))
+
+
+def _apply_children(self, parent, entries):
+    """
+    Привести дітей parent до entries, змінюючи лише різницю з моделлю
+    відображення: нові елементи вставляються, змінені — оновлюються,
+    порядок (зокрема переміщення з іншого батька) виставляє один set_children.
+    Елементи, що випали з parent, лише від'єднуються — їх видаляє _delete_stale.
+    :return: list of iids
+    """
+    state = self._tree_state
+    items = state['items']
+    ids = [entry[0] for entry in entries]
+    old_ids = state['children'].get(parent, [])
+    wanted = set(ids)
+    # Порядок у Treeview після вставок у кінець
+    order = [iid for iid in old_ids if iid in wanted]
+    for iid, text, values, tags in entries:
+        data = (text, values, tags)
+        old = items.get(iid)
+        if old is None:
+            # Папка, розкрита до видалення з дерева (фільтр, плоский режим), — знову розкрита
+            self.tree.insert(parent, 'end', iid=iid, text=text, values=values, tags=tags,
+                             open=iid in state['opened'])
+            order.append(iid)
+        elif old != data:
+            self.tree.item(iid, text=text, values=values, tags=tags)
+        items[iid] = data
+    if order != ids:
+        self.tree.set_children(parent, *ids)
+    state['children'][parent] = ids
+    return ids
+
+
+def _apply_folder(self, iid, seen, rows):
+    """
+    Вміст вузла папки: повний, якщо папку вже розкривали, інакше заглушка.
+    rows — записи розкритих папок (_folder_rows).
+    """
+    state = self._tree_state
+    if iid in state['loaded']:
+        folder = _iid_folder(iid)
+        ids = _apply_children(self, iid, _folder_entries(self, folder, rows.get(folder, [])))
     else:
-        for did,name,vals,ctrl,folder in rows:
-            tag = 'controlled' if ctrl else ''
-            self.tree.insert('', 'end', iid=str(did), text=name, values=vals, tags=(tag,))
+        ids = _apply_children(self, iid, [(iid + _PLACEHOLDER, '…', (), ())])
+    seen.update(ids)
+    for child in ids:
+        if child.startswith(_FOLDER_PREFIX) and not child.endswith(_PLACEHOLDER):
+            _apply_folder(self, child, seen, rows)
 
-    # 8) Відновити вузли
-    for n in open_nodes:
-        if self.tree.exists(n): self.tree.item(n, open=True)
 
-    # 9) Підсвітка контрольних
+def _apply_flat(self, seen):
+    """
+    Плоский список: перші flat_limit записів і рядок MORE_IID з заглушкою,
+    розкриття якого (або прокрутка до кінця) додає ще FLAT_PAGE_SIZE записів.
+    """
+    state = self._tree_state
+    rows = state['flat_rows']
+    limit = state['flat_limit']
+    entries = _row_entries(rows[:limit])
+    rest = len(rows) - limit
+    if rest > 0:
+        entries.append((MORE_IID, f"… ще {rest} записів", (), ()))
+    seen.update(_apply_children(self, '', entries))
+    if rest > 0:
+        seen.update(_apply_children(self, MORE_IID, [(MORE_IID + _PLACEHOLDER, '…', (), ())]))
+
+
+def _delete_stale(self, seen):
+    """
+    Видалити з дерева та моделі все, чого немає в новому відображенні.
+    Розкриті папки лишаються в loaded, а їхній стан open — в opened,
+    тож після повернення (зміна фільтра, плоский режим) вони знову розкриті.
+    """
+    state = self._tree_state
+    stale = [iid for iid in state['items'] if iid not in seen]
+    for iid in stale:
+        if iid in state['loaded']:
+            if self.tree.item(iid, 'open'):
+                state['opened'].add(iid)
+            else:
+                state['opened'].discard(iid)
+        del state['items'][iid]
+        state['children'].pop(iid, None)
+    if stale:
+        # Один виклик: Treeview сам пропускає нащадків уже видалених елементів
+        self.tree.delete(*stale)
+
+
+def load_documents_into_tree(self, hierarchical=True):
+    """
+    Завантажити документи в дерево.
+    Якщо hierarchical=True, групувати за папками (folder): спершу вставляється
+    лише корінь, а вміст кожної папки читається з БД при її розкритті.
+    Інакше — плоский список, який вставляється сторінками по FLAT_PAGE_SIZE.
+
+    Дерево не перебудовується: новий результат порівнюється з моделлю
+    відображення (_tree_state) і застосовується лише різниця, тож
+    відкриті вузли, виділення та прокрутка зберігаються.
+    """
+    dup_only = getattr(self, 'show_duplicates', None)
+    state = getattr(self, '_tree_state', None)
+    if state is None:
+        # Модель відображення: iid → (text, values, tags), батько → [iids],
+        # розкриті (завантажені) папки та ті з них, що були відкриті при видаленні;
+        # скільки записів плоского списку показано
+        state = self._tree_state = {'items': {}, 'children': {}, 'loaded': set(),
+                                    'opened': set(), 'flat_limit': FLAT_PAGE_SIZE}
+    state['dup_only'] = bool(dup_only.get()) if dup_only is not None else False
+    state['canonical'] = {}
+    state['subfolders'] = {}
+    top = self.tree.yview()[0]
+
+    state['flat_rows'] = []
+    seen = {''}
+    if not hierarchical:
+        # Плоский список: відсортовані записи, у дерево — лише показана частина
+        state['flat_rows'] = _sort_rows(self, _query_rows(self))
+        _apply_flat(self, seen)
+    else:
+        # Структура папок з відповідними записами (лише назви папок, без документів)
+        where, params = build_filter_sql(self)
+        subfolders = state['subfolders']
+        # «+» не дає обрати idx_documents_folder заради DISTINCT замість індексу фільтра
+        column = '+d.folder' if where else 'd.folder'
+        for (folder,) in db.query(f"SELECT DISTINCT {column} FROM documents d {where}", params):
+            parts = folder.split(os.sep) if folder else []
+            for i, part in enumerate(parts):
+                subfolders.setdefault(os.sep.join(parts[:i]), set()).add(part)
+        seen.update(_apply_children(self, '', [(ROOT_IID, '📁 [Корінь]', (), ())]))
+        # Записи всіх розкритих папок — одним запитом
+        rows = _folder_rows(self, {_iid_folder(iid) for iid in state['loaded']})
+        _apply_folder(self, ROOT_IID, seen, rows)
+    _delete_stale(self, seen)
+    self.tree.yview_moveto(top)
+
+    # Підсвітка контрольних і відсутніх на диску
     self.tree.tag_configure('controlled', background='#ffe5e5')
+    self.tree.tag_configure('missing', foreground='gray')
+
+
+def expand_folder(self, iid):
+    """
+    Завантажити вміст папки iid (обробник <<TreeviewOpen>>): підпапки з
+    відповідними записами та документи самої папки.
+    """
+    state = getattr(self, '_tree_state', None)
+    if iid == MORE_IID:
+        load_more_rows(self)
+        return
+    if state is None or iid in state['loaded'] or not self.tree.exists(iid + _PLACEHOLDER):
+        return
+    state['loaded'].add(iid)
+    placeholder = iid + _PLACEHOLDER
+    folder = _iid_folder(iid)
+    _apply_folder(self, iid, set(), _folder_rows(self, {folder}))
+    del state['items'][placeholder]
+    self.tree.delete(placeholder)
+
+
+def load_more_rows(self):
+    """
+    Додати наступні FLAT_PAGE_SIZE записів плоского списку (розкриття рядка
+    MORE_IID або прокрутка до кінця). Записи беруться з останнього
+    load_documents_into_tree, без звернення до БД.
+    :return: False, якщо показано всі записи
+    """
+    state = getattr(self, '_tree_state', None)
+    if state is None or not self.tree.exists(MORE_IID):
+        return False
+    state['flat_limit'] += FLAT_PAGE_SIZE
+    seen = {''}
+    _apply_flat(self, seen)
+    if MORE_IID in seen:
+        self.tree.item(MORE_IID, open=False)
+    _delete_stale(self, seen)
+    return True
+
+
+def format_modified(last_modified, is_missing=False):
+    """Значення колонки «Змінено» зі збереженого last_modified (без звернення до диска)."""
+    if is_missing or not last_modified:
+        return ''
+    return datetime.fromtimestamp(last_modified).strftime('%d-%m-%Y %H:%M')
+
+
+def row_tags(ctrl, missing=False):
+    tags = []
+    if ctrl:
+        tags.append('controlled')
+    if missing:
+        tags.append('missing')
+    return tuple(tags)
+
+
+def update_modified_cells(self, changes):
+    """
+    Оновити «Змінено» і позначку відсутності лише для змінених записів,
+    що зараз є в дереві. changes: list of tuples (id, last_modified, is_missing)
+    """
+    items = getattr(self, '_tree_state', {}).get('items', {})
+    for did, last_modified, missing in changes:
+        iid = str(did)
+        if iid not in items:
+            continue
+        text, values, tags = items[iid]
+        values = (*values[:-1], format_modified(last_modified, missing))
+        tags = tuple(t for t in tags if t != 'missing') + (('missing',) if missing else ())
+        self.tree.item(iid, values=values, tags=tags)
+        items[iid] = (text, values, tags)
+
+
+def update_document_rows(self, ids):
+    """
+    Оновити рядки записів ids і їхніх дублікатів (після хешування їм могли
+    передатись метадані), що зараз є в дереві, без перезавантаження дерева.
+    Належність до фільтра перевіряє наступний load_registry_data.
+    """
+    items = getattr(self, '_tree_state', {}).get('items', {})
+    if not items or not ids:
+        return
+    rows = _query_rows(
+        self,
+        "d.file_hash IN (SELECT x.file_hash FROM documents x "
+        "WHERE x.id IN (SELECT value FROM json_each(?)))",
+        (json.dumps(list(ids)),)
+    )
+    for iid, text, values, tags in _row_entries(rows):
+        data = (text, values, tags)
+        if items.get(iid, data) == data:
+            continue
+        self.tree.item(iid, text=text, values=values, tags=tags)
+        items[iid] = data
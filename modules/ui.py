@@ -1,5 +1,6 @@
 # modules/ui.py
 
+import logging
 import os
 import threading
 import queue
@@ -7,27 +8,32 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 
 from config import DB_PATH
-from .database import db, init_db, get_new_files_count, get_new_file_ids, mark_all_as_old
+from .database import db, get_new_files_count, get_new_file_ids, mark_all_as_old
 from .filter_frame import FilterFrame
 from .context_menu import build_context_menu, open_selected
-from .tree_setup import setup_tree_widget, load_documents_into_tree
+from .tree_setup import (
+    setup_tree_widget, load_documents_into_tree, load_more_rows,
+    update_modified_cells, update_document_rows
+)
 from .scanner import insert_new_files
-from .utils import compute_file_hash
 from .calendar_tab import CalendarTab
 from .settings_tab import SettingsTab
 from .settings import SettingsManager
 from .detail_panel import DetailPanel
+from .watcher import FolderWatcher
+from .hash_updater import HashJob
+from .stat_refresher import StatRefresher
+
+logger = logging.getLogger(__name__)
 
 
 class DocumentApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, full_scan=False):
         super().__init__()
         self.title("Реєстр документів")
         self.state('zoomed')
         self.geometry("1600x780")
 
-        init_db()
-
         # Стиль прогрес-бару
         style = ttk.Style(self)
         style.theme_use('clam')
@@ -60,10 +66,12 @@ class DocumentApp(tk.Tk):
         self.filter_date_to   = ""
         self.filter_num_main  = ""
         self.filter_num_extra = ""
-        self.filter_new       = False
+        self.filter_new       = None
 
         # Ієрархія/плоский
         self.show_hierarchy = tk.BooleanVar(value=True)
+        # Лише файли з дублікатами за вмістом
+        self.show_duplicates = tk.BooleanVar(value=False)
 
         # Очікуюча черга оновлень UI
         self._ui_queue = queue.Queue()
@@ -99,19 +107,40 @@ class DocumentApp(tk.Tk):
         self.progress.pack(side=tk.LEFT, fill=tk.X, expand=True)
         self.status_label = ttk.Label(status_frame, text="Готовий", anchor='w')
         self.status_label.pack(side=tk.LEFT, padx=(10,0))
+        self.hash_btn = ttk.Button(status_frame, text="Пауза хешування",
+                                   command=self.toggle_hashing, state="disabled")
+        self.hash_btn.pack(side=tk.LEFT, padx=(10,0))
 
         # Папка для сканування
         sm = SettingsManager()
         self.current_scan_folder = sm.get_active()
+        self.scan_workers = sm.get_scan_workers()
+        self.watch_enabled = sm.get_watch_enabled()
+        self.watcher = None
+        self.hash_job = None
+        # Хто зараз показує хід у рядку стану: 'scan', 'hash' або None
+        self._status_owner = None
+        self.stat_refresher = None
 
         # --- вкладка «Реєстр» ---
         self._setup_registry_tab()
 
-        # Запуск первинного сканування
-        self.after(200, lambda: threading.Thread(
-                target=self._scan_and_update,
-                daemon=True
-            ).start())
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
+        # Запуск первинного сканування; запити під час сканування чекають у _pending_scan
+        self._scan_lock = threading.Lock()
+        self._scan_running = False
+        self._pending_scan = None
+        self.after(200, lambda: self.start_scan(full_scan=full_scan))
+    def _on_close(self):
+        # Зупиняємо фонові задачі до закриття вікна
+        self.stop_watcher()
+        if self.hash_job is not None:
+            self.hash_job.stop()
+        if self.stat_refresher is not None:
+            self.stat_refresher.stop()
+        self.destroy()
+
     def _process_ui_queue(self):
         """Обробляє чергу оновлень від фонового потоку."""
         try:
@@ -139,6 +168,13 @@ class DocumentApp(tk.Tk):
         )
         cb.pack(side=tk.RIGHT, padx=(0, 10))
 
+        ttk.Checkbutton(
+            top,
+            text="Дублікати",
+            variable=self.show_duplicates,
+            command=self.load_registry_data
+        ).pack(side=tk.RIGHT, padx=(0, 10))
+
         self.new_files_btn = ttk.Button(
             top,
             text=f"Нові файли ({get_new_files_count()})",
@@ -155,7 +191,7 @@ class DocumentApp(tk.Tk):
         setup_tree_widget(self)
 
         vsb = ttk.Scrollbar(left, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=vsb.set)
+        self.tree.configure(yscrollcommand=lambda first, last: self._on_tree_scroll(vsb, first, last))
         vsb.pack(side=tk.RIGHT, fill=tk.Y)
 
         hsb = ttk.Scrollbar(left, orient="horizontal", command=self.tree.xview)
@@ -174,62 +210,206 @@ class DocumentApp(tk.Tk):
         self.tree.bind("<<TreeviewSelect>>", self.on_select)
         self.tree.bind("<Button-3>",        self.on_right_click)
         self.tree.bind("<Double-1>", lambda e: open_selected(self))
+        # Поки користувач працює з деревом, фонове хешування відступає
+        for seq in ("<ButtonPress>", "<KeyPress>", "<MouseWheel>"):
+            self.tree.bind(seq, self._on_user_activity, add="+")
+
+    def _on_tree_scroll(self, vsb, first, last):
+        vsb.set(first, last)
+        # Плоский список догружається, коли прокрутка дійшла до кінця
+        if float(last) >= 1.0:
+            self.after_idle(lambda: load_more_rows(self))
 
     def _load_doc_types(self):
         rows = db.query("SELECT type_name FROM document_types ORDER BY type_name")
         return [r[0] for r in rows]
 
-    def _scan_and_update(self):
-        total = 0
-        def cb(done, total_count):
-            nonlocal total
-            total = total_count
-            self._ui_queue.put(lambda: self._update_progress(done, total))
+    def start_scan(self, full_scan=False, on_done=None):
+        """
+        Запускає сканування активного каталогу у фоновому потоці.
+        Якщо сканування вже виконується, запит чекає і виконується одразу після
+        нього (запити, що надійшли за цей час, об'єднуються в одне сканування).
+        on_done викликається в потоці UI після _finish_scan.
+        :return: False, якщо сканування вже виконується (запит поставлено в чергу)
+        """
+        with self._scan_lock:
+            full, callbacks = self._pending_scan or (False, [])
+            self._pending_scan = (full or full_scan, callbacks + ([on_done] if on_done else []))
+            if self._scan_running:
+                return False
+            self._scan_running = True
+        threading.Thread(target=self._scan_and_update, daemon=True).start()
+        return True
 
-        # Оновлюємо UI перед скануванням
-        self._ui_queue.put(lambda: self.new_files_btn.config(state="disabled"))
-        self._ui_queue.put(lambda: self.status_label.config(text="Сканування…"))
-
-        try:
-            insert_new_files(base_dir=self.current_scan_folder, progress_callback=cb)
-        finally:
-            self._ui_queue.put(self._finish_scan)
-
-    def _update_progress(self, done, total):
+    def _scan_and_update(self):
+        def cb(progress):
+            self._ui_queue.put(lambda: self._update_progress(progress))
+
+        while True:
+            with self._scan_lock:
+                if self._pending_scan is None:
+                    self._scan_running = False
+                    return
+                full_scan, callbacks = self._pending_scan
+                self._pending_scan = None
+
+            # Оновлюємо UI перед скануванням
+            self._ui_queue.put(lambda: self.new_files_btn.config(state="disabled"))
+            self._ui_queue.put(lambda: self._set_status("Сканування…", owner='scan'))
+            try:
+                # Правила читаються щоразу: запит у черзі міг з'явитися після їх зміни
+                rules = SettingsManager().get_rules(self.current_scan_folder)
+                insert_new_files(base_dir=self.current_scan_folder, progress_callback=cb,
+                                 full_scan=full_scan, workers=self.scan_workers, rules=rules)
+            except Exception:
+                logger.exception("Scan failed")
+            finally:
+                self._ui_queue.put(self._finish_scan)
+                for on_done in callbacks:
+                    self._ui_queue.put(on_done)
+
+    def _update_progress(self, progress, label="Сканування"):
+        self.status_label.config(text=f"{label}: {progress.describe()}")
+        if not progress.total:
+            # Загальна кількість невідома — показуємо лише лічильник
+            return
         if self.progress['mode'] != 'determinate':
-            self.progress.config(mode="determinate", maximum=total)
-        self.progress['value'] = done
-        self.status_label.config(text=f"Сканування: {done}/{total}")
+            self.progress.config(mode="determinate")
+        self.progress.config(maximum=progress.total)
+        self.progress['value'] = progress.done
 
     def _finish_scan(self):
         # Завершуємо сканування
         self.progress.stop()
         self.progress.config(mode="indeterminate", value=0)
-        self.status_label.config(text="Готово")
+        self._set_status("Готово")
         self.new_files_btn.config(state="normal")
         self.load_registry_data()
         cnt = get_new_files_count()
         self.new_files_btn.config(text=f"Нові файли ({cnt})")
 
-        # Тепер запускаємо обчислення хешів з прогресом
-        ##threading.Thread(target=self._hash_and_update, daemon=True).start()
+        # Після первинного сканування зміни підхоплює спостерігач
+        if self.watch_enabled:
+            self.start_watcher()
 
+        # Тепер запускаємо (або будимо) фонове обчислення хешів
+        self.start_hashing()
+        self.start_stat_refresher()
 
-    def show_new_files(self):
-        new_ids = set(get_new_file_ids())
-        if not new_ids:
+    def start_hashing(self):
+        if self.hash_job is not None:
+            self.hash_job.wake()
+            return
+        sm = SettingsManager()
+        self.hash_job = HashJob(
+            progress_callback=lambda p: self._ui_queue.put(lambda: self._update_hash_progress(p)),
+            done_callback=lambda ids: self._ui_queue.put(lambda: self._finish_hashing(ids)),
+            workers=sm.get_hash_workers(),
+            mb_per_sec=sm.get_hash_budget(),
+            engine=sm.get_hash_engine(),
+            algorithm=sm.get_hash_algorithm()
+        )
+        self.hash_job.start()
+        self.hash_btn.config(state="normal")
+
+    def configure_hashing(self, workers, mb_per_sec):
+        # Ліміт діє одразу, кількість процесів — з наступного проходу
+        if self.hash_job is not None:
+            self.hash_job.workers = workers
+            self.hash_job.set_budget(mb_per_sec)
+
+    def toggle_hashing(self):
+        if self.hash_job is None:
+            return
+        if self.hash_job.paused:
+            self.hash_job.resume()
+            self.hash_btn.config(text="Пауза хешування")
+            if self._status_owner != 'scan':
+                self._set_status("Хешування…", owner='hash')
+        else:
+            self.hash_job.pause()
+            self.hash_btn.config(text="Продовжити хешування")
+            if self._status_owner != 'scan':
+                self._set_status("Хешування призупинено", owner='hash')
+
+    def _set_status(self, text, owner=None):
+        self.status_label.config(text=text)
+        self._status_owner = owner
+
+    def _on_user_activity(self, event=None):
+        if self.hash_job is not None:
+            self.hash_job.touch()
+        if self.stat_refresher is not None:
+            self.stat_refresher.touch()
+
+    def start_stat_refresher(self):
+        if self.stat_refresher is not None:
+            return
+        self.stat_refresher = StatRefresher(
+            on_change=lambda changes: self._ui_queue.put(lambda: self._on_stat_changes(changes))
+        )
+        self.stat_refresher.start()
+
+    def _on_stat_changes(self, changes):
+        update_modified_cells(self, changes)
+        # Змінений вміст втратив хеш — його обчислить фонове хешування
+        if self.hash_job is not None and any(not missing for _, _, missing in changes):
+            self.hash_job.wake()
+
+    def _update_hash_progress(self, progress):
+        # Під час сканування рядок стану та індикатор належать скануванню
+        if self.hash_job is None or self.hash_job.paused or self._status_owner == 'scan':
+            return
+        self._status_owner = 'hash'
+        self._update_progress(progress, label="Хешування")
+
+    def _finish_hashing(self, ids):
+        if self._status_owner == 'hash':
+            self.progress.config(mode="indeterminate", value=0)
+            self._set_status("Готово")
+        if ids:
+            # Хеші могли перенести метадані дублікатів — оновлюємо лише ці рядки
+            update_document_rows(self, ids)
+
+    def start_watcher(self):
+        if self.watcher is not None:
             return
+        sm = SettingsManager()
+        folders = sm.get_folders()
+        self.watcher = FolderWatcher(
+            folders,
+            on_change=lambda count: self._ui_queue.put(self._on_watch_change),
+            workers=self.scan_workers,
+            rules={f: sm.get_rules(f) for f in folders}
+        )
+        self.watcher.start()
+
+    def stop_watcher(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
 
-        def prune(node):
-            for child in list(self.tree.get_children(node)):
-                if not child.isdigit():
-                    prune(child)
-                elif int(child) not in new_ids:
-                    self.tree.delete(child)
-                if not self.tree.get_children(node) and node != "":
-                    self.tree.delete(node)
+    def restart_watcher(self):
+        if self.watcher is not None:
+            self.stop_watcher()
+            self.start_watcher()
 
-        prune("")
+    def _on_watch_change(self):
+        # Спостерігач застосував зміни — оновлюємо лічильник і дерево
+        cnt = get_new_files_count()
+        self.new_files_btn.config(text=f"Нові файли ({cnt})")
+        self.load_registry_data()
+        if self.hash_job is not None:
+            self.hash_job.wake()
+
+
+    def show_new_files(self):
+        new_ids = get_new_file_ids()
+        if not new_ids:
+            return
+        # Фільтр діє до наступного apply_filters (пошук / «Скинути»)
+        self.filter_new = new_ids
+        self.load_registry_data()
         mark_all_as_old()
         self.new_files_btn.config(text="Нові файли (0)")
 
@@ -239,6 +419,7 @@ class DocumentApp(tk.Tk):
         self.load_registry_data()
 
     def load_registry_data(self):
+        self._on_user_activity()
         self.progress.start()
         threading.Thread(target=self._bg_load_registry, daemon=True).start()
 
@@ -261,6 +442,7 @@ class DocumentApp(tk.Tk):
         self.filter_date_to   = date_to or ""
         self.filter_num_main  = (num_main or "").lower()
         self.filter_num_extra = (num_extra or "").lower()
+        self.filter_new       = None
         self.load_registry_data()
 
     def on_select(self, event):
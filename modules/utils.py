@@ -2,6 +2,7 @@ import os
 import subprocess
 import sys
 import hashlib
+import mmap
 
 def open_folder(filepath):
     """
@@ -33,12 +34,82 @@ def delete_file(filepath):
         os.remove(filepath)
 
 
-def compute_file_hash(path, chunk_size=8192):
+# Алгоритми повного хешу. SHA-256 зберігається без префікса (як у наявних записах),
+# інші — з префіксом "<алгоритм>:", тож хеші різних алгоритмів ніколи не збігаються
+# і завжди відомо, яким алгоритмом перераховувати файл для порівняння.
+HASH_ALGORITHMS = ('sha256', 'blake2b')
+DEFAULT_HASH_ALGORITHM = 'sha256'
+# Режими читання: буфер readinto, hashlib.file_digest (Python 3.11+), mmap
+HASH_MODES = ('buffered', 'file_digest', 'mmap')
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def compute_file_hash(path, chunk_size=HASH_BUFFER_SIZE, algorithm=DEFAULT_HASH_ALGORITHM, mode='buffered'):
     """
-    Обчислює SHA-256 хеш вмісту файлу та повертає його у вигляді шістнадцяткового рядка.
+    Обчислює хеш вмісту файлу алгоритмом algorithm і повертає відбиток format_hash().
+    mode – спосіб читання (HASH_MODES); file_digest без підтримки в hashlib
+    замінюється буферним читанням.
+    """
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        if mode == 'file_digest' and hasattr(hashlib, 'file_digest'):
+            h = hashlib.file_digest(f, algorithm)
+        elif mode == 'mmap' and os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                h.update(m)
+        else:
+            buf = bytearray(chunk_size)
+            view = memoryview(buf)
+            for n in iter(lambda: f.readinto(buf), 0):
+                h.update(view[:n])
+    return format_hash(algorithm, h.hexdigest())
+
+
+def format_hash(algorithm, hexdigest):
+    if algorithm == 'sha256':
+        return hexdigest
+    return f"{algorithm}:{hexdigest}"
+
+
+def hash_algorithm(fingerprint):
+    """Алгоритм повного хешу fingerprint або None, якщо це не повний хеш."""
+    if not is_full_hash(fingerprint):
+        return None
+    return fingerprint.split(':', 1)[0] if ':' in fingerprint else 'sha256'
+
+
+# Відбитки файлів нижчих рівнів (для файлів, що не можуть мати дублікатів).
+# Повний SHA-256 зберігається як є (шістнадцятковий рядок без префікса).
+SIZE_FINGERPRINT_PREFIX = "size:"
+PARTIAL_FINGERPRINT_PREFIX = "part:"
+
+
+def compute_partial_hash(path, size, block_size=64 * 1024):
+    """
+    Обчислює SHA-256 перших і останніх block_size байтів файлу
+    (для малих файлів — усього вмісту).
     """
     h = hashlib.sha256()
     with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(chunk_size), b''):
-            h.update(chunk)
-    return h.hexdigest()
\ No newline at end of file
+        h.update(f.read(block_size))
+        if size > 2 * block_size:
+            f.seek(size - block_size)
+            h.update(f.read(block_size))
+        elif size > block_size:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def size_fingerprint(size):
+    return f"{SIZE_FINGERPRINT_PREFIX}{size}"
+
+
+def partial_fingerprint(size, digest):
+    return f"{PARTIAL_FINGERPRINT_PREFIX}{size}:{digest}"
+
+
+def is_full_hash(fingerprint):
+    """Чи є відбиток повним хешем вмісту (а не розміром чи частковим хешем)."""
+    return bool(fingerprint) and not fingerprint.startswith(
+        (SIZE_FINGERPRINT_PREFIX, PARTIAL_FINGERPRINT_PREFIX)
+    )
@@ -0,0 +1,261 @@
+# modules/watcher.py
+
+import logging
+import os
+import threading
+
+from .database import (
+    insert_documents_batch, get_max_document_id,
+    get_document_ids_by_paths, mark_vanished
+)
+from .scanner import insert_new_files, reconcile, scan_lock
+from .scan_rules import compile_rules
+
+logger = logging.getLogger(__name__)
+
+# watchdog (inotify / ReadDirectoryChangesW) — необов'язкова залежність
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        kind = event.event_type
+        if kind not in ("created", "modified", "deleted", "moved"):
+            return
+        if event.is_directory:
+            # Зміни каталогів обробляє інкрементальне сканування батьківського каталогу
+            if kind != "modified":
+                self.watcher.mark_dirty(event.src_path)
+                if kind == "moved":
+                    self.watcher.mark_dirty(event.dest_path)
+            return
+        if kind == "moved":
+            # Переміщення = зникнення + поява; reconcile збереже метадані
+            self.watcher.push(event.src_path, "delete")
+            self.watcher.push(event.dest_path, "upsert")
+        elif kind == "deleted":
+            self.watcher.push(event.src_path, "delete")
+        else:
+            self.watcher.push(event.src_path, "upsert")
+
+
+class FolderWatcher:
+    """
+    Фоновий спостерігач за каталогами з SettingsManager.
+
+    Події файлової системи (створення/зміна/видалення/переміщення) збираються
+    в черзі, де кілька подій для одного шляху зливаються в одну, і раз на
+    batch_delay секунд застосовуються до documents малими батчами.
+    Створення, видалення чи переміщення каталогу скановує лише батьківський
+    каталог (його піддерево — інкрементально); увесь корінь — лише якщо таких
+    каталогів понад max_dirty_dirs за batch_delay.
+    Якщо watchdog недоступний, використовується опитування: періодичне
+    інкрементальне сканування, яке читає лише каталоги зі зміненим mtime;
+    поки змін немає, інтервал подвоюється від poll_interval до max_poll_interval.
+
+    on_change(count) викликається з фонового потоку після кожного батчу,
+    що змінив записи. rules — {корінь: правила}; виключені шляхи ігноруються.
+    """
+    def __init__(self, folders, on_change=None, poll_interval=10.0,
+                 batch_delay=1.0, workers=1, rules=None, max_dirty_dirs=100,
+                 max_poll_interval=300.0):
+        self.folders = [str(f) for f in folders if f]
+        rules = rules or {}
+        self.rules = {f: compile_rules(rules.get(f)) for f in self.folders}
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max(poll_interval, max_poll_interval)
+        self.max_dirty_dirs = max_dirty_dirs
+        self.batch_delay = batch_delay
+        self.workers = workers
+        self.backend = "watchdog" if Observer is not None else "polling"
+
+        self._pending = {}
+        # {корінь: set каталогів для сканування або None — увесь корінь}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._observer = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        if self.backend == "watchdog":
+            self._observer = Observer()
+            handler = _EventHandler(self)
+            for folder in self.folders:
+                if os.path.isdir(folder):
+                    self._observer.schedule(handler, folder, recursive=True)
+            self._observer.daemon = True
+            self._observer.start()
+            target = self._apply_loop
+        else:
+            target = self._poll_loop
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        logger.info("Watching %d folder(s) using %s", len(self.folders), self.backend)
+
+    def stop(self, timeout=5.0):
+        """
+        Зупиняє спостереження й чекає на фоновий потік не довше timeout секунд
+        (батч, що саме застосовується, завершиться, нові вже не почнуться).
+        """
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout)
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning("Watcher thread did not stop within %.1f s", timeout)
+            self._thread = None
+
+    # --- черга подій ---
+
+    def push(self, path, kind):
+        with self._lock:
+            self._pending[path] = kind
+
+    def mark_dirty(self, path):
+        """Каталог path створено, видалено чи переміщено: сканувати його батьківський."""
+        root = self._root_for(path)
+        if root is None:
+            return
+        parent = os.path.dirname(path.rstrip("/\\")) if not _inside(root, path) else root
+        if not self.rules[root].allow_dir_path(_rel(parent, root)):
+            return
+        with self._lock:
+            dirs = self._dirty.setdefault(root, set())
+            if dirs is None:
+                return
+            dirs.add(parent)
+            if len(dirs) > self.max_dirty_dirs:
+                # Переповнення: дешевше пройти корінь інкрементально
+                self._dirty[root] = None
+
+    def _root_for(self, path):
+        best = None
+        for folder in self.folders:
+            if _inside(path, folder) and (best is None or len(folder) > len(best)):
+                best = folder
+        return best
+
+    def _drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            dirty, self._dirty = self._dirty, {}
+        return pending, dirty
+
+    # --- застосування змін ---
+
+    def _apply_loop(self):
+        while not self._stop.wait(self.batch_delay):
+            pending, dirty = self._drain()
+            if not pending and not dirty:
+                continue
+            try:
+                changed = self._apply(pending, dirty)
+            except Exception as e:
+                logger.exception("Failed to apply changes: %s", e)
+                continue
+            if changed and self.on_change:
+                self.on_change(changed)
+
+    def _apply(self, pending, dirty):
+        changed = 0
+        with scan_lock:
+            scanned = {}
+            for root, dirs in dirty.items():
+                dirs = _outermost(dirs, root) if dirs is not None else None
+                changed += insert_new_files(root, workers=self.workers,
+                                            rules=self.rules[root], dirs=dirs)
+                scanned[root] = dirs or [root]
+
+            by_root = {}
+            for path, kind in pending.items():
+                root = self._root_for(path)
+                if root is None or any(_inside(path, d) for d in scanned.get(root, ())):
+                    # Файл уже оброблено скануванням його каталогу
+                    continue
+                if not self.rules[root].allow_path(os.path.relpath(path, root)):
+                    continue
+                by_root.setdefault(root, []).append((path, kind))
+
+            for root, events in by_root.items():
+                since_id = get_max_document_id()
+                records, gone = [], []
+                for path, kind in events:
+                    try:
+                        st = os.stat(path) if kind == "upsert" else None
+                    except OSError:
+                        st = None
+                    if st is None:
+                        gone.append(path)
+                        continue
+                    folder = os.path.relpath(os.path.dirname(path), root)
+                    records.append((os.path.basename(path), path,
+                                    '' if folder == '.' else folder,
+                                    st.st_mtime, None, st.st_size,
+                                    st.st_ino or None, st.st_ctime))
+                if records:
+                    changed += insert_documents_batch(records)
+                if gone:
+                    mark_vanished(get_document_ids_by_paths(gone), root)
+                moved, deleted = reconcile(root, since_id)
+                changed += moved + deleted
+        return changed
+
+    def _poll_loop(self):
+        delay = self.poll_interval
+        while not self._stop.wait(delay):
+            changed = 0
+            for folder in self.folders:
+                try:
+                    changed += insert_new_files(folder, workers=self.workers,
+                                                rules=self.rules[folder])
+                except Exception as e:
+                    logger.exception("Poll of %s failed: %s", folder, e)
+            delay = self.poll_interval if changed else min(delay * 2, self.max_poll_interval)
+            if changed and self.on_change:
+                self.on_change(changed)
+
+
+def _inside(path, folder):
+    """path — це folder або шлях усередині нього."""
+    prefix = folder.rstrip("/\\")
+    return path.startswith(prefix) and path[len(prefix):len(prefix) + 1] in ("", "/", "\\")
+
+
+def _rel(path, root):
+    rel = os.path.relpath(path, root)
+    return '' if rel == '.' else rel
+
+
+def _outermost(dirs, root):
+    """
+    Каталоги dirs без вкладених один в одного; каталог, якого вже немає
+    (видалено разом з батьківським), замінюється найближчим наявним предком.
+    """
+    existing = set()
+    for path in dirs:
+        while path != root and not os.path.isdir(path) and _inside(path, root):
+            path = os.path.dirname(path)
+        existing.add(path if _inside(path, root) else root)
+    ordered = sorted(existing, key=len)
+    result = []
+    for path in ordered:
+        if not any(_inside(path, kept) for kept in result):
+            result.append(path)
+    return result
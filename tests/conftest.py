@@ -0,0 +1,17 @@
+"""
+Спільне налаштування тестів.
+
+modules.database відкриває config.DB_PATH під час імпорту, тож шлях до БД
+підміняється на тимчасовий до першого імпорту modules: тести не торкаються
+робочої БД config/db.sqlite.
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import config  # noqa: E402
+
+_tmp = tempfile.TemporaryDirectory(prefix="reyestr-tests-")
+config.DB_PATH = Path(_tmp.name) / "db.sqlite"
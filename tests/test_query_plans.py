@@ -0,0 +1,244 @@
+"""
+Регресійна перевірка планів виконання запитів до БД.
+
+SQL не копіюється в тест вручну: тест проганяє справжні шляхи коду
+(сканування й узгодження переміщень, хешування з синхронізацією метаданих,
+дерево реєстру з фільтрами, пошук, зв'язки) на тестовій БД, записує кожен
+виконаний оператор через sqlite3.Connection.set_trace_callback і для
+кожного виконує EXPLAIN QUERY PLAN. Повний прохід (SCAN) великої таблиці —
+помилка, крім навмисно повних читань з ALLOWED_SCANS.
+
+Фільтри, які індексом не обслуговуються за визначенням (пошук 1–2 символів,
+instr по типу, тегах, номерах, «недопрацьовані»), тут не вмикаються.
+"""
+import os
+import re
+import shutil
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+# Таблиці, що ростуть разом з кількістю файлів
+LARGE_TABLES = {"documents", "document_numbers"}
+
+# Навмисно повні читання: шаблон (re.fullmatch по SQL з нормалізованими пробілами) → причина
+ALLOWED_SCANS = {
+    r"SELECT DISTINCT d\.folder FROM documents d":
+        "структура папок без фільтрів: потрібні всі папки",
+    r"SELECT d\.id, d\.filename, .* FROM documents d":
+        "плоский список без фільтрів: потрібні всі записи",
+}
+
+_SKIP_RE = re.compile(r"^\s*(--|(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|PRAGMA|CREATE|DROP|ALTER)\b)",
+                      re.I)
+_SCAN_RE = re.compile(r"^SCAN (\w+)")
+_ALIAS_RE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(?!WHERE\b|ON\b|JOIN\b|SET\b|USING\b|GROUP\b|ORDER\b|VALUES\b|LIMIT\b|UNION\b|LEFT\b|INNER\b)(\w+))?", re.I)
+
+
+def _normalize(sql):
+    return ' '.join(sql.split())
+
+
+def _aliases(sql):
+    aliases = {}
+    for table, alias in _ALIAS_RE.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def full_scans(conn, sql):
+    """Рядки плану з повним проходом великої таблиці."""
+    aliases = _aliases(sql)
+    scans = []
+    for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+        m = _SCAN_RE.match(row[3])
+        if m and aliases.get(m.group(1), m.group(1)) in LARGE_TABLES:
+            scans.append(row[3])
+    return scans
+
+
+class _Tree:
+    """Мінімальна модель ttk.Treeview для tree_setup."""
+    def __init__(self):
+        self.items = {'': {'parent': None, 'children': []}}
+
+    def insert(self, parent, index, iid, **kw):
+        self.items[iid] = {'parent': parent, 'children': [], **kw}
+        self.items[parent]['children'].append(iid)
+        return iid
+
+    def delete(self, *iids):
+        for iid in iids:
+            if iid in self.items:
+                self.delete(*self.items[iid]['children'])
+                siblings = self.items[self.items[iid]['parent']]['children']
+                if iid in siblings:
+                    siblings.remove(iid)
+                del self.items[iid]
+
+    def set_children(self, parent, *iids):
+        for iid in iids:
+            old = self.items[iid]['parent']
+            if old != parent:
+                self.items[old]['children'].remove(iid)
+                self.items[iid]['parent'] = parent
+        self.items[parent]['children'] = list(iids)
+
+    def exists(self, iid):
+        return iid in self.items
+
+    def get_children(self, iid=''):
+        return tuple(self.items[iid]['children'])
+
+    def item(self, iid, option=None, **kw):
+        self.items[iid].update(kw)
+        return self.items[iid].get(option) if option else self.items[iid]
+
+    def focus(self, iid=None):
+        return ''
+
+    def tag_configure(self, *args, **kw):
+        pass
+
+    def yview(self):
+        return 0.0, 1.0
+
+    def yview_moveto(self, fraction):
+        pass
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+@contextmanager
+def _recording(db, statements):
+    """Записує SQL усіх підключень db (записувача і читачів пулу) у statements."""
+    def trace(sql):
+        statements.append(sql)
+
+    open_reader = db._open_reader
+
+    def traced_reader():
+        conn = open_reader()
+        conn.set_trace_callback(trace)
+        return conn
+
+    conns = [db._conn, *db._all_readers]
+    for conn in conns:
+        conn.set_trace_callback(trace)
+    db._open_reader = traced_reader
+    try:
+        yield
+    finally:
+        del db._open_reader
+        for conn in [db._conn, *db._all_readers]:
+            conn.set_trace_callback(None)
+
+
+def _workload(base):
+    from modules import database, scanner, tree_setup
+    from modules.hash_updater import background_hash_updates
+    from modules.stat_refresher import StatRefresher
+
+    root = str(base)
+    # Перше сканування, хешування, метадані
+    scanner.insert_new_files(root, precount=True, batch_size=4)
+    background_hash_updates(max_workers=1, engine='thread')
+    ids = {path: doc_id for doc_id, path in database.get_root_documents(root)}
+    letter = ids[os.path.join(root, 'Вхідні', 'лист.pdf')]
+    order = ids[os.path.join(root, 'Накази', 'наказ.docx')]
+    database.update_documents([letter], {'doc_type': 'Лист', 'doc_date': '2025-03-01',
+                                         'sender': 'Мінфін', 'description': 'звіт'})
+    database.save_document_numbers(letter, [('вхідний', '12/3')])
+    database.db.execute("INSERT INTO document_links (from_doc_id, to_doc_id, link_type) VALUES (?, ?, ?)",
+                        (letter, order, 'відповідь'))
+
+    # Копія з метаданими оригіналу, переміщення, видалення; повторне сканування
+    shutil.copy2(os.path.join(root, 'Вхідні', 'лист.pdf'), os.path.join(root, 'Архів', 'лист (копія).pdf'))
+    os.replace(os.path.join(root, 'Накази', 'наказ.docx'), os.path.join(root, 'Архів', 'наказ.docx'))
+    os.remove(os.path.join(root, 'Вхідні', '2024', 'старий.txt'))
+    scanner.insert_new_files(root, batch_size=4)
+    background_hash_updates(max_workers=1, engine='thread')
+    StatRefresher(delay=0, idle_delay=0).refresh()
+
+    # Дерево реєстру: ієрархія з розкритими папками, плоский список, фільтри
+    app = SimpleNamespace(tree=_Tree(), sort_by_col=None, sort_reverse=False,
+                          show_duplicates=SimpleNamespace(get=lambda: False))
+    tree_setup.load_documents_into_tree(app, True)
+    for iid in (tree_setup.ROOT_IID, 'folder::Вхідні', 'folder::Архів'):
+        tree_setup.expand_folder(app, iid)
+    tree_setup.load_documents_into_tree(app, False)
+    for attrs in ({'search_term': 'звіт'},
+                  {'filter_date_from': '2025-01-01', 'filter_date_to': '2025-12-31'},
+                  {'filter_date_from': '2025-01-01'},
+                  {'filter_date_to': '2025-12-31'},
+                  {'filter_new': database.get_new_file_ids()},
+                  {'show_duplicates': SimpleNamespace(get=lambda: True)}):
+        vars(app).update(attrs)
+        tree_setup.load_documents_into_tree(app, True)
+        tree_setup.load_documents_into_tree(app, False)
+        for attr in attrs:
+            setattr(app, attr, None if attr != 'show_duplicates' else SimpleNamespace(get=lambda: False))
+    tree_setup.update_document_rows(app, [letter])
+
+    # Пошук, зв'язки, номери, нові файли, видалення
+    database.search_documents('звіт', exclude_id=order)
+    database.get_links_for([letter, order])
+    database.get_linked_count(letter)
+    database.get_document_numbers(letter)
+    database.get_documents([letter, order])
+    database.get_new_files_count()
+    database.mark_all_as_old()
+    database.delete_documents([order])
+
+
+@pytest.fixture(scope="module")
+def statements(tmp_path_factory):
+    from modules import database
+
+    base = tmp_path_factory.mktemp("docs")
+    for rel, data in [('Вхідні/лист.pdf', b'letter'), ('Вхідні/2024/старий.txt', b'old'),
+                      ('Вхідні/2024/скан.pdf', b'letter'), ('Накази/наказ.docx', b'order'),
+                      ('Архів/.keep', b''), ('readme.txt', b'root')]:
+        _write(os.path.join(base, *rel.split('/')), data)
+
+    database.init_db()
+    recorded = []
+    with _recording(database.db, recorded):
+        _workload(base)
+    checked = {}
+    for sql in recorded:
+        if not _SKIP_RE.match(sql):
+            checked.setdefault(_normalize(sql), sql)
+    return checked
+
+
+def test_workload_covers_hot_queries(statements):
+    # Захист від тихого звуження: перевірка має бачити основні запити
+    expected = ["SELECT DISTINCT +d.folder FROM documents d WHERE",
+                "INSERT INTO documents", "ON CONFLICT",
+                "UPDATE documents SET doc_type=src.doc_type",
+                "FROM scan_vanished v JOIN documents d",
+                "documents_fts MATCH",
+                "d.doc_date >="]
+    missing = [text for text in expected if not any(text in sql for sql in statements)]
+    assert not missing
+
+
+def test_no_full_scans_of_large_tables(statements):
+    from modules.database import db
+
+    problems = []
+    for normalized, sql in statements.items():
+        if any(re.fullmatch(pattern, normalized) for pattern in ALLOWED_SCANS):
+            continue
+        scans = full_scans(db._conn, sql)
+        if scans:
+            problems.append(f"{normalized}\n    " + "\n    ".join(scans))
+    assert not problems, "Full scans:\n" + "\n".join(problems)